@@ -5,50 +5,1470 @@ Created on Thu Oct 15 12:48:00 2020
          (British Geological Survey, The Lyell Centre,
          Edinburgh, UK).
 """
-import pandas as pd
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Mapping
 from pathlib import Path
-from pymatreader import read_mat
+
+import numpy as np
+import pandas as pd
+
+from pyvolcans.timings import timed
 
 BASE_DIR = Path(__file__).resolve().parent
 DIRNAME_ANALOGY = BASE_DIR.joinpath("analogy_mats")
 DIRNAME_VOLCANO = BASE_DIR.joinpath("VOTW_prepared_data")
 DIRNAME_DATA = BASE_DIR.joinpath("data_mats")
+DIRNAME_TOP_ANALOGUES = BASE_DIR.joinpath("top_analogues")
+
+# environment variable that overrides the default cache directory
+CACHE_DIR_ENV = "PYVOLCANS_CACHE_DIR"
+
+# environment variable that selects the storage type of the analogy matrices
+STORAGE_ENV = "PYVOLCANS_ANALOGY_STORAGE"
+
+# environment variable selecting the data backend used by the loaders
+BACKEND_ENV = "PYVOLCANS_DATA_BACKEND"
+
+# storage types for the analogy values; uint16 stores values in [0, 1] as
+# fixed-point numbers with a scale of 1/65535
+ANALOGY_STORAGE = {"float64": np.float64,
+                   "float32": np.float32,
+                   "float16": np.float16,
+                   "uint16": np.uint16}
+
+# volcanological criteria, in the order used to stack the analogy matrices
+CRITERIA = ("tectonic_setting", "geochemistry", "morphology",
+            "eruption_size", "eruption_style")
+
+# MATLAB file and variable name holding the data for each criterion
+ANALOGY_SOURCES = {
+    "tectonic_setting": ("ATfinal_allvolcs.mat", "AT_allcross"),
+    "geochemistry": ("AGfinal_allvolcs_ALU_QUET.mat", "AG_allcross"),
+    "morphology": ("AMfinal_allvolcs_QUET.mat", "AM_allcross"),
+    "eruption_size": ("ASzfinal_allvolcs_SINA.mat", "ASz_allcross"),
+    "eruption_style": ("AStfinal_allvolcs_SINA.mat", "ASt_allcross"),
+}
+DATA_SOURCES = {
+    "tectonic_setting": ("ATmatrices.mat", "ATlast"),
+    "geochemistry": ("AGmatrices_ALU_QUET.mat", "AGnormmat"),
+    "morphology": ("AMmatrices_QUET.mat", "AMlast"),
+    "eruption_size": ("ASzmatrices_SINA.mat", "ASznorm_ALL"),
+    "eruption_style": ("AStmatrices_SINA.mat", "AStnormmat"),
+}
+VOLCANO_NAMES_SOURCE = "volc_names.csv"
+
+# layout of the data bundle: magic bytes, header length, JSON header, blocks
+BUNDLE_MAGIC = b"PYVOLCNS"
+BUNDLE_VERSION = 3
+BUNDLE_STEM = f"pyvolcans_bundle_v{BUNDLE_VERSION}_{{}}"
+BUNDLE_ALIGNMENT = 64
+_BUNDLE_PREFIX = struct.Struct("<8sQ")
+
+# tables of top analogues for all volcanoes, one per storage type and
+# weighting scheme
+TOP_ANALOGUES_VERSION = 2
+TOP_ANALOGUES_STEM = f"top_analogues_v{TOP_ANALOGUES_VERSION}_{{}}_{{}}"
+
+# per-criterion indices of volcanoes sorted by analogy, in the cache
+ANALOGY_ORDER_VERSION = 1
+ANALOGY_ORDER_STEM = f"analogy_order_v{ANALOGY_ORDER_VERSION}_{{}}"
+
+# source files read by PyVOLCANS, from which all the cached data are derived
+SOURCE_FILES = tuple(
+    [DIRNAME_ANALOGY.joinpath(filename)
+     for filename, _ in ANALOGY_SOURCES.values()]
+    + [DIRNAME_DATA.joinpath(filename)
+       for filename, _ in DATA_SOURCES.values()]
+    + [DIRNAME_VOLCANO.joinpath(VOLCANO_NAMES_SOURCE)])
+MANIFEST_FILENAME = "manifest.json"
+
+
+def get_cache_dir():
+    """
+    Returns the directory used to cache data converted from the VOLCANS
+    MATLAB files. It can be set with the PYVOLCANS_CACHE_DIR environment
+    variable, otherwise the user cache directory of the platform is used.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return Path(cache_dir)
+
+    if sys.platform == "win32":
+        cache_home = os.environ.get("LOCALAPPDATA", Path.home())
+    else:
+        cache_home = os.environ.get("XDG_CACHE_HOME",
+                                    Path.home().joinpath(".cache"))
+    return Path(cache_home).joinpath("pyvolcans")
+
+
+def _atomic_write(filename, data):
+    """
+    Writes the bytes in data to filename. The file is written under a
+    temporary name and then renamed, so concurrent processes never see a
+    partially written file.
+    """
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=filename.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+def _sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_source_manifest(rehash=False):
+    """
+    Returns the manifest of the VOLCANS source files: the size, modification
+    time and SHA-256 content hash of every file read by PyVOLCANS (see
+    SOURCE_FILES), keyed by path relative to BASE_DIR. Other files in the
+    data directories, which are not shipped with the package, do not change
+    the manifest.
+
+    The manifest is stored in the cache directory, and hashes are only
+    recomputed for files whose size or modification time have changed,
+    unless rehash is True.
+    """
+    manifest_file = get_cache_dir().joinpath(MANIFEST_FILENAME)
+    try:
+        stored = json.loads(manifest_file.read_text())
+    except (OSError, ValueError):
+        stored = {}
+
+    source_files = sorted(SOURCE_FILES)
+    manifest = {}
+    for path in source_files:
+        name = path.relative_to(BASE_DIR).as_posix()
+        stat = path.stat()
+        entry = stored.get(name)
+        if (rehash or entry is None or entry["size"] != stat.st_size
+                or entry["mtime_ns"] != stat.st_mtime_ns):
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                     "sha256": _sha256(path)}
+        manifest[name] = entry
+
+    if manifest != stored:
+        try:
+            _atomic_write(manifest_file,
+                          json.dumps(manifest, indent=2).encode("utf-8"))
+        except OSError:
+            pass
+
+    return manifest
+
+
+def get_source_key(manifest=None):
+    """
+    Returns a short key derived from the content hashes of all the source
+    files (see get_source_manifest). Every file derived from the sources is
+    named after this key, so that it is rebuilt whenever a source changes.
+    """
+    if manifest is None:
+        manifest = get_source_manifest()
+    digest = hashlib.sha256()
+    for name, entry in sorted(manifest.items()):
+        digest.update(f"{name}:{entry['sha256']}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def get_artefact_path(stem, suffix, source_key):
+    """Returns the cache path of a file derived from the source files."""
+    return get_cache_dir().joinpath(f"{stem}_{source_key}{suffix}")
+
+
+def list_artefacts(source_key=None):
+    """
+    Lists the files derived from the source files in the cache directory,
+    as (path, is_current) tuples, where is_current indicates whether the
+    file was built from the current source files.
+    """
+    if source_key is None:
+        source_key = get_source_key()
+    cache_dir = get_cache_dir()
+    if not cache_dir.is_dir():
+        return []
+
+    artefacts = []
+    for path in sorted(cache_dir.iterdir()):
+        if path.name == MANIFEST_FILENAME or not path.is_file():
+            continue
+        is_current = path.stem.endswith(f"_{source_key}")
+        artefacts.append((path, is_current))
+
+    return artefacts
+
+
+def get_analogy_storage():
+    """
+    Returns the storage type of the analogy matrices, as set by the
+    PYVOLCANS_ANALOGY_STORAGE environment variable (default float64).
+    """
+    storage = os.environ.get(STORAGE_ENV) or "float64"
+    if storage not in ANALOGY_STORAGE:
+        raise ValueError(f"Unknown analogy storage type ({storage}). "
+                         f"Use one of: {', '.join(ANALOGY_STORAGE)}")
+    return storage
+
+
+def encode_analogies(values, storage):
+    """
+    Converts analogy values (between 0 and 1) to the given storage type.
+    Integer storage types hold fixed-point values, rounded to the nearest
+    multiple of 1 / (maximum integer value).
+    """
+    dtype = np.dtype(ANALOGY_STORAGE[storage])
+    values = np.asarray(values, dtype=np.float64)
+    if dtype.kind == "u":
+        scale = np.iinfo(dtype).max
+        return np.round(np.clip(values, 0, 1) * scale).astype(dtype)
+    return values.astype(dtype)
+
+
+def decode_analogies(values):
+    """Converts stored analogy values back to float64 (see encode_analogies)."""
+    if values.dtype.kind == "u":
+        return values / np.iinfo(values.dtype).max
+    return values.astype(np.float64, copy=False)
+
+
+def _align(offset):
+    return -(-offset // BUNDLE_ALIGNMENT) * BUNDLE_ALIGNMENT
+
+
+def pack_bundle(blocks, metadata=None):
+    """
+    Packs a dictionary of NumPy arrays into the bytes of a data bundle.
+
+    The bundle starts with the magic bytes and the length of a JSON header
+    that lists the dtype, shape and byte offset of each block. Blocks are
+    stored in C order and aligned to 64 bytes, so that any of them can be
+    viewed without copying (see DataBundle).
+
+    Parameters
+    ----------
+    blocks : dict
+        Arrays to store in the bundle, keyed by block name.
+    metadata : dict, optional
+        Other values (serialisable to JSON) to store in the header.
+
+    Returns
+    -------
+    bundle : bytes
+    """
+    arrays = {name: np.ascontiguousarray(array)
+              for name, array in blocks.items()}
+
+    # offsets depend on the header length, so iterate until it is stable
+    header_length = 0
+    while True:
+        offset = _align(_BUNDLE_PREFIX.size + header_length)
+        layout = {}
+        for name, array in arrays.items():
+            layout[name] = {"dtype": array.dtype.str,
+                            "shape": list(array.shape),
+                            "offset": offset}
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({"version": BUNDLE_VERSION,
+                             "metadata": metadata or {},
+                             "blocks": layout}).encode("utf-8")
+        if len(header) == header_length:
+            break
+        header_length = len(header)
+
+    buffer = bytearray(offset)
+    _BUNDLE_PREFIX.pack_into(buffer, 0, BUNDLE_MAGIC, header_length)
+    buffer[_BUNDLE_PREFIX.size:_BUNDLE_PREFIX.size + header_length] = header
+    for name, array in arrays.items():
+        start = layout[name]["offset"]
+        buffer[start:start + array.nbytes] = array.tobytes()
+
+    return bytes(buffer)
+
+
+class DataBundle:
+    """
+    Read-only view of a data bundle written by pack_bundle.
+
+    Parameters
+    ----------
+    buffer : buffer
+        Bytes of the bundle, e.g. a memory-mapped file. Blocks are returned
+        as NumPy arrays that share memory with this buffer.
+    """
+
+    def __init__(self, buffer):
+        magic, header_length = _BUNDLE_PREFIX.unpack_from(buffer, 0)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError("Buffer does not contain a PyVOLCANS data bundle")
+        header_end = _BUNDLE_PREFIX.size + header_length
+        header = json.loads(bytes(buffer[_BUNDLE_PREFIX.size:header_end]))
+        if header["version"] != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported data bundle version "
+                             f"({header['version']})")
+        self.buffer = buffer
+        self.layout = header["blocks"]
+        self.metadata = header["metadata"]
+
+    def __contains__(self, name):
+        return name in self.layout
+
+    def block(self, name):
+        """Returns the named block as an array without copying it."""
+        spec = self.layout[name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count,
+                              offset=spec["offset"])
+        return array.reshape(spec["shape"])
+
+
+class SymmetricAnalogyMatrix:
+    """
+    Symmetric N x N matrix of single-criterion analogy values (AX_ij = AX_ji,
+    see Tierz et al., 2019), stored as its packed upper triangle, row by row
+    and including the diagonal. This halves the memory needed by the full
+    matrix.
+
+    Rows are rebuilt from the packed values with vectorised index arithmetic
+    (see row() and rows()), and multiplying by a scalar or adding two
+    matrices returns a new packed matrix, so weighted analogy matrices can be
+    combined without building the full N x N arrays.
+
+    The packed values may use a reduced-precision storage type (see
+    encode_analogies), in which case they are decoded to float64 whenever
+    rows are extracted or arithmetic is done.
+
+    Parameters
+    ----------
+    packed : array
+        Upper triangle of the matrix, of length N * (N + 1) / 2.
+    """
+
+    ndim = 2
+
+    def __init__(self, packed):
+        packed = np.asarray(packed)
+        n = int((np.sqrt(8 * packed.size + 1) - 1) // 2)
+        if packed.ndim != 1 or n * (n + 1) // 2 != packed.size:
+            raise ValueError(f"Packed array of shape {packed.shape} is not "
+                             "the upper triangle of a square matrix")
+        self.packed = packed
+        self.n = n
+        # position in packed of the diagonal element of each row
+        rows = np.arange(n, dtype=np.int64)
+        self._row_start = rows * n - rows * (rows - 1) // 2
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """Packs the upper triangle of a symmetric N x N matrix."""
+        matrix = np.asarray(matrix)
+        return cls(matrix[np.triu_indices(matrix.shape[0])])
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def dtype(self):
+        return self.packed.dtype
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def _packed_indices(self, row_idx):
+        """Positions in packed of the elements of one or more rows."""
+        row_idx = np.asarray(row_idx)[..., np.newaxis]
+        col_idx = np.arange(self.n)
+        low = np.minimum(row_idx, col_idx)
+        high = np.maximum(row_idx, col_idx)
+        return self._row_start[low] + (high - low)
+
+    def encode(self, storage):
+        """Returns a copy of the matrix using the given storage type."""
+        return type(self)(encode_analogies(decode_analogies(self.packed),
+                                           storage))
+
+    def row(self, volcano_idx):
+        """Returns row volcano_idx of the full matrix, as an (N,) array."""
+        return decode_analogies(self.packed[self._packed_indices(volcano_idx)])
+
+    def rows(self, volcano_indices):
+        """Returns several rows of the full matrix, as a (T, N) array."""
+        return decode_analogies(
+            self.packed[self._packed_indices(volcano_indices)])
+
+    def values(self, volcano_idx, columns):
+        """
+        Returns the elements of row volcano_idx in the given columns only,
+        without rebuilding the whole row.
+        """
+        columns = np.asarray(columns)
+        low = np.minimum(volcano_idx, columns)
+        high = np.maximum(volcano_idx, columns)
+        return decode_analogies(self.packed[self._row_start[low] +
+                                            (high - low)])
+
+    def to_dense(self):
+        """Returns the full N x N matrix."""
+        return self.rows(np.arange(self.n))
+
+    def __getitem__(self, key):
+        # support matrix[i] and matrix[i, ] as used with NumPy arrays
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if isinstance(key, tuple):
+            return self.to_dense()[key]
+        return self.rows(key)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __len__(self):
+        return self.n
+
+    def __mul__(self, other):
+        if not np.isscalar(other):
+            return NotImplemented
+        return type(self)(decode_analogies(self.packed) * other)
+
+    __rmul__ = __mul__
+
+    def __add__(self, other):
+        if isinstance(other, SymmetricAnalogyMatrix):
+            return type(self)(decode_analogies(self.packed) +
+                              decode_analogies(other.packed))
+        if np.isscalar(other):
+            return type(self)(decode_analogies(self.packed) + other)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __repr__(self):
+        return f"{type(self).__name__}(n={self.n}, dtype={self.dtype})"
+
+
+class AnalogyStack(Mapping):
+    """
+    Analogy matrices of the five volcanological criteria stacked in the
+    order of CRITERIA, as the packed upper triangles of shape
+    (5, N * (N + 1) / 2) stored in the data bundle. The rows of all criteria
+    for one or more target volcanoes are read with a single gather (see
+    rows()), and each criterion can still be used as a SymmetricAnalogyMatrix
+    (stack[criterion]), so a stack can be given wherever a dictionary of
+    analogy matrices is expected.
+
+    Parameters
+    ----------
+    packed : array
+        Stacked upper triangles, with shape (5, N * (N + 1) / 2).
+    """
+
+    def __init__(self, packed):
+        if len(packed) != len(CRITERIA):
+            raise ValueError(f"Expected {len(CRITERIA)} stacked analogy "
+                             f"matrices, got {len(packed)}")
+        self.matrices = {criterion: SymmetricAnalogyMatrix(packed[i])
+                         for i, criterion in enumerate(CRITERIA)}
+        self.packed = packed
+        self.n = self.matrices[CRITERIA[0]].n
+
+    @property
+    def shape(self):
+        return (len(CRITERIA), self.n, self.n)
+
+    def rows(self, volcano_indices, criteria=None):
+        """
+        Returns the rows of all criteria for the given volcanoes, with shape
+        (5, N) for a single volcano index or (T, 5, N) for T indices. If
+        criteria is given (a boolean mask in the order of CRITERIA), only
+        the rows of those criteria are read and the others are zeros.
+        """
+        indices = self.matrices[CRITERIA[0]]._packed_indices(volcano_indices)
+        if criteria is None or np.all(criteria):
+            values = decode_analogies(self.packed[:, indices])
+            # NB. C order keeps the rounding of sums over the criteria the
+            # same as for rows read one criterion at a time
+            return np.ascontiguousarray(np.moveaxis(values, 0, -2))
+
+        # NB. The positions of the elements are shared by all criteria
+        rows = np.zeros(indices.shape[:-1] + (len(CRITERIA), self.n))
+        for i in np.flatnonzero(criteria):
+            rows[..., i, :] = decode_analogies(self.packed[i][indices])
+        return rows
+
+    def __getitem__(self, criterion):
+        return self.matrices[criterion]
+
+    def __iter__(self):
+        return iter(self.matrices)
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(n={self.n}, "
+                f"dtype={self.packed.dtype})")
+
+
+def read_source_blocks(storage="float64"):
+    """
+    Reads the VOLCANS MATLAB and csv files into the blocks of a data bundle:
+    the stacked upper triangles of the five analogy matrices, with shape
+    (5, N * (N + 1) / 2) ('analogy'), the volcano data for each criterion
+    ('data/<criterion>') and the raw bytes of the volcano names table
+    ('volcano_names'). The analogy values are converted to the given storage
+    type (see encode_analogies).
+    """
+    # pymatreader is slow to import and only needed to build the bundle
+    from pymatreader import read_mat
+
+    blocks = {"analogy": np.stack([
+        encode_analogies(SymmetricAnalogyMatrix.from_dense(
+            read_mat(DIRNAME_ANALOGY.joinpath(filename))[variable]).packed,
+                         storage)
+        for filename, variable in (ANALOGY_SOURCES[criterion]
+                                   for criterion in CRITERIA)])}
+    for criterion in CRITERIA:
+        filename, variable = DATA_SOURCES[criterion]
+        blocks[f"data/{criterion}"] = np.asarray(
+            read_mat(DIRNAME_DATA.joinpath(filename))[variable])
+    names_bytes = DIRNAME_VOLCANO.joinpath(VOLCANO_NAMES_SOURCE).read_bytes()
+    blocks["volcano_names"] = np.frombuffer(names_bytes, dtype=np.uint8)
+
+    return blocks
+
+
+def open_bundle(filename):
+    """Memory-maps the data bundle in filename (read-only)."""
+    with open(filename, "rb") as bundle_file:
+        buffer = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return DataBundle(buffer)
+
+
+# data bundles already opened, keyed by storage type of the analogy values
+_BUNDLES = {}
+
+
+@timed
+def get_bundle(storage=None):
+    """
+    Returns the data bundle with all the VOLCANS data, memory-mapped from the
+    cache directory. The bundle is built from the MATLAB and csv files the
+    first time that it is needed, and rebuilt whenever the content of the
+    source files changes (see get_source_key). If the cache cannot be
+    written, the bundle is kept in memory instead.
+
+    Building the bundle reads all the source files, including the five
+    analogy matrices, so with an empty (or read-only) cache directory the
+    first query for analogy values reads every criterion, whichever ones
+    it uses. The volcano names and data are read from their own source
+    files until the bundle has been built (see MatBackend).
+
+    Parameters
+    ----------
+    storage : str, optional
+        Storage type of the analogy values (see ANALOGY_STORAGE). By default
+        it is read from the PYVOLCANS_ANALOGY_STORAGE environment variable.
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    bundle = find_bundle(storage)
+    if bundle is None:
+        bundle_bytes = pack_bundle(read_source_blocks(storage),
+                                   {"source_key": get_source_key(),
+                                    "storage": storage})
+        bundle_file = get_artefact_path(BUNDLE_STEM.format(storage), ".bin",
+                                        get_source_key())
+        try:
+            _atomic_write(bundle_file, bundle_bytes)
+        except OSError:
+            bundle = DataBundle(bundle_bytes)
+        else:
+            bundle = open_bundle(bundle_file)
+        _BUNDLES[storage] = bundle
+
+    return bundle
+
+
+def find_bundle(storage=None):
+    """
+    Returns the data bundle for the storage type if it has already been
+    opened or built in the cache directory from the current source files,
+    or None (the bundle is not built, see get_bundle).
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    if storage not in _BUNDLES:
+        source_key = get_source_key()
+        bundle_file = get_artefact_path(BUNDLE_STEM.format(storage), ".bin",
+                                        source_key)
+        if not bundle_file.exists():
+            return None
+        try:
+            bundle = open_bundle(bundle_file)
+        except ValueError:
+            return None
+        if bundle.metadata.get("source_key") != source_key:
+            return None
+        _BUNDLES[storage] = bundle
+
+    return _BUNDLES[storage]
+
+
+def get_weights_key(weights):
+    """
+    Returns a short key identifying a weighting scheme (five weights in the
+    order of CRITERIA), after rounding the weights to 1e-9.
+    """
+    rounded = np.round(np.asarray(weights, dtype=np.float64) * 1e9)
+    # NB. Adding 0. turns -0. into 0., so both give the same key
+    return hashlib.sha256((rounded + 0.).tobytes()).hexdigest()[:12]
+
+
+class TopAnalogueTable:
+    """
+    Top analogue volcanoes of every volcano in the GVP database for one
+    weighting scheme: an (N, k) table of volcano indices (int16) and one of
+    total analogy values (float32), from highest to lowest analogy. Tables
+    are stored as data bundles (see pack_bundle) and memory-mapped, so
+    looking up the analogues of one volcano only reads its rows.
+
+    Parameters
+    ----------
+    bundle : DataBundle
+        Bundle with the blocks 'indices' and 'values', and the weights, the
+        source key and the storage type of the analogy values that the table
+        was built from in its metadata.
+    """
+
+    def __init__(self, bundle):
+        self.indices = bundle.block("indices")
+        self.values = bundle.block("values")
+        self.weights = np.array(bundle.metadata["weights"])
+        self.source_key = bundle.metadata["source_key"]
+        self.storage = bundle.metadata["storage"]
+
+    @property
+    def count(self):
+        """Number of top analogues stored for each volcano."""
+        return self.indices.shape[1]
+
+    @classmethod
+    def open(cls, filename):
+        """Memory-maps the table in filename."""
+        return cls(open_bundle(filename))
+
+    @staticmethod
+    def write(filename, indices, values, weights, source_key, storage):
+        """Writes a table of top analogues to filename."""
+        bundle_bytes = pack_bundle(
+            {"indices": np.asarray(indices, dtype=np.int16),
+             "values": np.asarray(values, dtype=np.float32)},
+            {"weights": [float(weight) for weight in weights],
+             "source_key": source_key,
+             "storage": storage})
+        _atomic_write(filename, bundle_bytes)
+
+    def top(self, volcano_idx, count=None):
+        """
+        Returns the indices (as int) and total analogy values of the top
+        count analogues of a volcano.
+        """
+        count = self.count if count is None else count
+        return (self.indices[volcano_idx, :count].astype(int),
+                self.values[volcano_idx, :count])
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(weights={self.weights.tolist()}, "
+                f"count={self.count}, storage={self.storage!r})")
+
+
+# tables of top analogues already opened, keyed by storage and weights key
+_TOP_ANALOGUE_TABLES = {}
+
+
+def get_top_analogues_stem(weights, storage=None):
+    """
+    Returns the file stem of the table of top analogues for weights, built
+    from the analogy values in the given storage type (by default, that set
+    by the PYVOLCANS_ANALOGY_STORAGE environment variable).
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    return TOP_ANALOGUES_STEM.format(storage, get_weights_key(weights))
+
+
+def get_top_analogues_path(weights, source_key=None, storage=None):
+    """Returns the cache path of the table of top analogues for weights."""
+    if source_key is None:
+        source_key = get_source_key()
+    return get_artefact_path(get_top_analogues_stem(weights, storage),
+                             ".bin", source_key)
 
 
+def find_top_analogue_table(weights, storage=None, count=None):
+    """
+    Returns the table of top analogues for the weighting scheme, either one
+    shipped with PyVOLCANS or one in the cache directory, or None if there
+    is no table for the weighting scheme built from the current source
+    files in the given storage type (by default, that set by the
+    PYVOLCANS_ANALOGY_STORAGE environment variable). If there are both,
+    the table with more analogues per volcano is returned. If count is
+    given, tables with fewer than count analogues per volcano are ignored.
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    table_key = (storage, get_weights_key(weights))
+    table = _TOP_ANALOGUE_TABLES.get(table_key)
+    if table is not None and (count is None or table.count >= count):
+        return table
+
+    source_key = get_source_key()
+    stem = get_top_analogues_stem(weights, storage)
+    best = None
+    for filename in (DIRNAME_TOP_ANALOGUES.joinpath(f"{stem}.bin"),
+                     get_top_analogues_path(weights, source_key, storage)):
+        if not filename.exists():
+            continue
+        try:
+            table = TopAnalogueTable.open(filename)
+        except (ValueError, KeyError):
+            continue
+        if (table.source_key == source_key and table.storage == storage
+                and (best is None or table.count > best.count)):
+            best = table
+
+    if best is None or (count is not None and best.count < count):
+        return None
+    _TOP_ANALOGUE_TABLES[table_key] = best
+    return best
+
+
+class AnalogyOrderIndex:
+    """
+    For each volcanological criterion, the volcanoes sorted from highest to
+    lowest single-criterion analogy with every volcano in the GVP database:
+    an N x N table of volcano indices (int16) per criterion, where ties are
+    sorted by volcano index. The index lets single-criterion queries by
+    analogy value (see above()) binary-search the sorted order of one row
+    and return a slice of it, instead of scanning and sorting the row.
+
+    Parameters
+    ----------
+    bundle : DataBundle
+        Bundle with the blocks 'order/<criterion>', and the storage type and
+        source key in its metadata.
+    analogies : AnalogyStack
+        Analogy matrices that the index was built from.
+    """
+
+    def __init__(self, bundle, analogies):
+        self.orders = {criterion: bundle.block(f"order/{criterion}")
+                       for criterion in CRITERIA}
+        self.storage = bundle.metadata["storage"]
+        self.source_key = bundle.metadata["source_key"]
+        self.analogies = analogies
+
+    @staticmethod
+    def build(analogies):
+        """
+        Sorts every row of the analogy matrix of each criterion, returning
+        the blocks of an index.
+        """
+        blocks = {}
+        for criterion in CRITERIA:
+            blocks[f"order/{criterion}"] = np.argsort(
+                -analogies[criterion].to_dense(), axis=1,
+                kind="stable").astype(np.int16)
+        return blocks
+
+    def above(self, criterion, volcano_idx, threshold, weight=1.0):
+        """
+        Returns the indices (as int) and weighted analogy values of all the
+        volcanoes whose analogy with volcano_idx, for one criterion and
+        multiplied by a positive weight, is greater than or equal to
+        threshold, from highest to lowest analogy. The volcano itself is
+        included if it meets the threshold.
+        """
+        order = self.orders[criterion][volcano_idx]
+        matrix = self.analogies[criterion]
+
+        # binary search for the first position below the threshold, reading
+        # only the values at the positions visited
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if weight * matrix.values(volcano_idx, order[middle]) >= \
+                    threshold:
+                low = middle + 1
+            else:
+                high = middle
+
+        indices = order[:low].astype(int)
+        return indices, weight * matrix.values(volcano_idx, indices)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(n={len(self.orders[CRITERIA[0]])}, "
+                f"storage={self.storage})")
+
+
+# analogy order indices already opened, keyed by storage type
+_ANALOGY_ORDER_INDICES = {}
+
+
+@timed
+def get_analogy_order_index(storage=None):
+    """
+    Returns the AnalogyOrderIndex of the analogy matrices with the given
+    storage type, memory-mapped from the cache directory. As with the data
+    bundle (see get_bundle), the index is built the first time that it is
+    needed, rebuilt whenever the source files change, and kept in memory if
+    the cache cannot be written.
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    if storage not in _ANALOGY_ORDER_INDICES:
+        analogies = load_analogy_stack(storage)
+        source_key = get_source_key()
+        stem = ANALOGY_ORDER_STEM.format(storage)
+        index_file = get_artefact_path(stem, ".bin", source_key)
+        bundle = None
+        if index_file.exists():
+            try:
+                bundle = open_bundle(index_file)
+            except ValueError:
+                pass
+            else:
+                if bundle.metadata.get("source_key") != source_key:
+                    bundle = None
+
+        if bundle is None:
+            index_bytes = pack_bundle(AnalogyOrderIndex.build(analogies),
+                                      {"source_key": source_key,
+                                       "storage": storage})
+            try:
+                _atomic_write(index_file, index_bytes)
+            except OSError:
+                bundle = DataBundle(index_bytes)
+            else:
+                bundle = open_bundle(index_file)
+        _ANALOGY_ORDER_INDICES[storage] = AnalogyOrderIndex(bundle,
+                                                            analogies)
+
+    return _ANALOGY_ORDER_INDICES[storage]
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+# shared-memory stores attached in this process, keyed by name
+_SHARED_STORES = {}
+
+
+class SharedAnalogyStore:
+    """
+    VOLCANS analogy matrices and volcano data published once in shared
+    memory, so that many worker processes can use them without each holding
+    its own copy.
+
+    The parent process calls SharedAnalogyStore.publish() and passes the
+    store (or its name) to the workers, which attach to the same memory as
+    read-only NumPy views. The store can be given to
+    calculate_weighted_analogy_matrix() and get_volcano_source_data() in
+    place of the default analogies and data, e.g.:
+
+        with SharedAnalogyStore.publish() as store:
+            with multiprocessing.Pool() as pool:
+                pool.starmap(calculate_weighted_analogy_matrix,
+                             [(volcano, WEIGHTS, store) for volcano in ...])
+
+    Pickling the store only sends its name, and each worker attaches to a
+    given store once. Requires Python 3.8 or newer.
+
+    Attributes
+    ----------
+    name : str
+        Name of the shared memory block.
+    analogies : AnalogyStack
+        Analogy matrices of the five volcanological criteria.
+    data : dict
+        Volcano data arrays for each volcanological criterion.
+    """
+
+    def __init__(self, shared_memory, owner=False):
+        self.shared_memory = shared_memory
+        self.name = shared_memory.name
+        self._owner = owner
+        bundle = DataBundle(shared_memory.buf)
+        self.analogies = AnalogyStack(_read_only(bundle.block("analogy")))
+        self.data = {criterion: _read_only(bundle.block(f"data/{criterion}"))
+                     for criterion in CRITERIA}
+
+    @classmethod
+    def publish(cls, storage=None):
+        """
+        Copies the data bundle (see get_bundle) into a new block of shared
+        memory. The block is removed when the store is closed.
+        """
+        from multiprocessing import shared_memory
+
+        buffer = get_bundle(storage).buffer
+        size = len(buffer)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        block.buf[:size] = buffer
+        store = cls(block, owner=True)
+        _SHARED_STORES[store.name] = store
+
+        return store
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to a store published by another process."""
+        if name not in _SHARED_STORES:
+            from multiprocessing import shared_memory
+            import multiprocessing
+
+            if sys.version_info >= (3, 13):
+                block = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                block = shared_memory.SharedMemory(name=name)
+                # child processes share the resource tracker of the parent,
+                # but any other process would remove the block on exit
+                if multiprocessing.parent_process() is None:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(block._name, "shared_memory")
+            _SHARED_STORES[name] = cls(block)
+
+        return _SHARED_STORES[name]
+
+    def close(self):
+        """
+        Detaches from the shared memory, and removes it if this process
+        published the store. Arrays taken from the store must not be used
+        afterwards.
+        """
+        _SHARED_STORES.pop(self.name, None)
+        self.analogies = self.data = None
+        if self._owner:
+            self.shared_memory.unlink()
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            # views of the memory are still referenced elsewhere; it is
+            # released when they are garbage collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        return (SharedAnalogyStore.attach, (self.name,))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name!r})"
+
+
+def _load_analogy(criterion, storage=None):
+    packed = get_bundle(storage).block("analogy")[CRITERIA.index(criterion)]
+    return SymmetricAnalogyMatrix(packed)
+
+
+# analogy stacks already built, keyed by storage type: (bundle, stack)
+_ANALOGY_STACKS = {}
+
+
+def load_analogy_stack(storage=None):
+    """
+    Returns the analogy matrices of all criteria as an AnalogyStack over
+    the data bundle (see get_bundle). The stack is reused while the bundle
+    stays the same.
+    """
+    if storage is None:
+        storage = get_analogy_storage()
+    bundle = get_bundle(storage)
+    if _ANALOGY_STACKS.get(storage, (None,))[0] is not bundle:
+        _ANALOGY_STACKS[storage] = (bundle,
+                                    AnalogyStack(bundle.block("analogy")))
+    return _ANALOGY_STACKS[storage][1]
+
+
+# NB. The volcano names and data do not depend on the storage type of the
+# analogy values, so they are read from the bundle for the storage in use
+def _load_data(criterion):
+    bundle = find_bundle()
+    if bundle is None:
+        # NB. Only the MATLAB file of the criterion is read, rather than
+        # building the bundle from all the source files
+        from pymatreader import read_mat
+        filename, variable = DATA_SOURCES[criterion]
+        return np.asarray(read_mat(DIRNAME_DATA.joinpath(filename))[variable])
+    return bundle.block(f"data/{criterion}")
+
+
+def _load_volcano_names_bytes():
+    bundle = find_bundle()
+    if bundle is None:
+        return DIRNAME_VOLCANO.joinpath(VOLCANO_NAMES_SOURCE).read_bytes()
+    return bundle.block("volcano_names").tobytes()
+
+
+class RowMatrix:
+    """
+    N x N analogy matrix stored on disk (e.g. in an HDF5 dataset), of which
+    only the requested rows are read. Supports the same row access as
+    SymmetricAnalogyMatrix.
+
+    Parameters
+    ----------
+    dataset : array-like
+        Two-dimensional dataset that reads rows when indexed with an integer
+        or an increasing list of integers (e.g. an h5py.Dataset).
+    """
+
+    ndim = 2
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def shape(self):
+        return tuple(self.dataset.shape)
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    def row(self, volcano_idx):
+        """Returns row volcano_idx of the matrix, as an (N,) array."""
+        return decode_analogies(np.asarray(self.dataset[int(volcano_idx)]))
+
+    def rows(self, volcano_indices):
+        """Returns several rows of the matrix, as a (T, N) array."""
+        volcano_indices = np.asarray(volcano_indices)
+        if volcano_indices.ndim == 0:
+            return self.row(volcano_indices)
+        # rows must be read in increasing order, without repetitions
+        unique_indices, inverse = np.unique(volcano_indices,
+                                            return_inverse=True)
+        values = np.asarray(self.dataset[unique_indices.tolist()])
+        return decode_analogies(values[inverse.reshape(volcano_indices.shape)])
+
+    def to_dense(self):
+        """Returns the full N x N matrix."""
+        return decode_analogies(np.asarray(self.dataset[()]))
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if isinstance(key, tuple):
+            return self.to_dense()[key]
+        return self.rows(key)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.dataset!r})"
+
+
+class DataBackend:
+    """
+    Source of the VOLCANS data used by the load_* functions. Subclasses read
+    the analogy matrix and volcano data of each volcanological criterion and
+    the table of volcano names. Analogy matrices are returned as objects
+    whose rows can be read one at a time (matrix[volcano_idx]), so that
+    backends able to do so only read the rows needed by a query.
+    """
+
+    def read_analogy(self, criterion):
+        """Returns the N x N analogy matrix of the criterion."""
+        raise NotImplementedError
+
+    def read_data(self, criterion):
+        """Returns the volcano data of the criterion."""
+        raise NotImplementedError
+
+    def read_volcano_names(self):
+        """Returns the volcano names, countries and numbers (VNUM)."""
+        raise NotImplementedError
+
+    def read_analogy_stack(self):
+        """
+        Returns the analogy matrices of all criteria as an AnalogyStack, or
+        None if the backend does not store them stacked.
+        """
+        return None
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class MatBackend(DataBackend):
+    """
+    The VOLCANS MATLAB and csv files shipped with PyVOLCANS, read through
+    the cached data bundle (see get_bundle). This is the default backend.
+    Until the bundle has been built, the volcano names and data are read
+    directly from their source files, so that importing PyVOLCANS does not
+    read the analogy matrices.
+    """
+
+    def read_analogy(self, criterion):
+        return _load_analogy(criterion)
+
+    def read_analogy_stack(self):
+        return load_analogy_stack()
+
+    def read_data(self, criterion):
+        return _load_data(criterion)
+
+    def read_volcano_names(self):
+        return pd.read_csv(io.BytesIO(_load_volcano_names_bytes()),
+                           header=None)
+
+
+class NpyBackend(DataBackend):
+    """
+    Directory of NumPy files: analogy_<criterion>.npy, data_<criterion>.npy
+    and volc_names.csv. The analogy files may hold the full N x N matrix or
+    its packed upper triangle (see SymmetricAnalogyMatrix), and are memory-
+    mapped, so only the pages of the rows used are read from disk.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory with the files, e.g. as written by NpyBackend.write().
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def read_analogy(self, criterion):
+        matrix = np.load(self.directory.joinpath(f"analogy_{criterion}.npy"),
+                         mmap_mode="r")
+        if matrix.ndim == 1:
+            return SymmetricAnalogyMatrix(matrix)
+        return matrix
+
+    def read_data(self, criterion):
+        return np.load(self.directory.joinpath(f"data_{criterion}.npy"))
+
+    def read_volcano_names(self):
+        return pd.read_csv(self.directory.joinpath(VOLCANO_NAMES_SOURCE),
+                           header=None)
+
+    @classmethod
+    def write(cls, directory, source=None, packed=False):
+        """
+        Writes the data of the source backend (MatBackend by default) to
+        directory, as full N x N analogy matrices, or as their packed upper
+        triangles if packed is True.
+        """
+        source = MatBackend() if source is None else source
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for criterion in CRITERIA:
+            matrix = source.read_analogy(criterion)
+            if packed:
+                matrix = SymmetricAnalogyMatrix.from_dense(matrix)
+                values = decode_analogies(matrix.packed)
+            else:
+                values = np.asarray(matrix, dtype=np.float64)
+            np.save(directory.joinpath(f"analogy_{criterion}.npy"), values)
+            np.save(directory.joinpath(f"data_{criterion}.npy"),
+                    np.asarray(source.read_data(criterion)))
+        source.read_volcano_names().to_csv(
+            directory.joinpath(VOLCANO_NAMES_SOURCE), header=False,
+            index=False)
+        return cls(directory)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({str(self.directory)!r})"
+
+
+class HDF5Backend(DataBackend):
+    """
+    HDF5 file with the datasets analogy/<criterion>, chunked by row,
+    data/<criterion> and volcano_names (the bytes of the csv table). A
+    query for a single target volcano only reads its row of each analogy
+    matrix, which keeps the data read small on network filesystems.
+    Requires h5py.
+
+    Parameters
+    ----------
+    filename : str or Path
+        HDF5 file, e.g. as written by HDF5Backend.write().
+    """
+
+    def __init__(self, filename):
+        import h5py
+
+        self.filename = Path(filename)
+        self.file = h5py.File(self.filename, "r")
+
+    def read_analogy(self, criterion):
+        return RowMatrix(self.file[f"analogy/{criterion}"])
+
+    def read_data(self, criterion):
+        return self.file[f"data/{criterion}"][()]
+
+    def read_volcano_names(self):
+        names_bytes = self.file["volcano_names"][()].tobytes()
+        return pd.read_csv(io.BytesIO(names_bytes), header=None)
+
+    @classmethod
+    def write(cls, filename, source=None):
+        """
+        Writes the data of the source backend (MatBackend by default) to
+        filename, storing each analogy matrix in chunks of one row.
+        """
+        import h5py
+
+        source = MatBackend() if source is None else source
+        with h5py.File(filename, "w") as h5_file:
+            for criterion in CRITERIA:
+                matrix = np.asarray(source.read_analogy(criterion),
+                                    dtype=np.float64)
+                h5_file.create_dataset(f"analogy/{criterion}", data=matrix,
+                                       chunks=(1, matrix.shape[1]))
+                h5_file.create_dataset(f"data/{criterion}",
+                                       data=np.asarray(
+                                           source.read_data(criterion)))
+            names_bytes = source.read_volcano_names().to_csv(
+                header=False, index=False).encode("utf-8")
+            h5_file.create_dataset(
+                "volcano_names",
+                data=np.frombuffer(names_bytes, dtype=np.uint8))
+        return cls(filename)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({str(self.filename)!r})"
+
+
+# backend used by the load_* functions, set from the PYVOLCANS_DATA_BACKEND
+# environment variable when first needed
+_BACKEND = None
+
+
+def get_backend():
+    """
+    Returns the backend used by the load_* functions. Unless set with
+    set_backend(), it is chosen with the PYVOLCANS_DATA_BACKEND environment
+    variable: 'mat' (default), 'npy:<directory>' or 'hdf5:<filename>'.
+    """
+    global _BACKEND
+    if _BACKEND is None:
+        _BACKEND = _backend_from_spec(os.environ.get(BACKEND_ENV) or "mat")
+    return _BACKEND
+
+
+def set_backend(backend):
+    """
+    Sets the backend used by the load_* functions, given as a DataBackend
+    or as a string (see get_backend). None restores the default. Data
+    already loaded (e.g. by pyvolcans_func) are not reloaded.
+    """
+    global _BACKEND
+    if isinstance(backend, str):
+        backend = _backend_from_spec(backend)
+    _BACKEND = backend
+
+
+def _backend_from_spec(spec):
+    kind, _, location = spec.partition(":")
+    backends = {"mat": MatBackend, "npy": NpyBackend, "hdf5": HDF5Backend}
+    if kind not in backends or (kind == "mat") == bool(location):
+        raise ValueError(f"Unknown data backend {spec!r}: expected 'mat', "
+                         "'npy:<directory>' or 'hdf5:<filename>'")
+    return backends[kind](location) if location else backends[kind]()
+
+
+@timed
 def load_tectonic_analogy():
-    return read_mat(DIRNAME_ANALOGY.joinpath("ATfinal_allvolcs.mat"))["AT_allcross"]
+    return get_backend().read_analogy("tectonic_setting")
 
 
+@timed
 def load_geochemistry_analogy():
-    return read_mat(DIRNAME_ANALOGY.joinpath("AGfinal_allvolcs_ALU_QUET.mat"))["AG_allcross"]
+    return get_backend().read_analogy("geochemistry")
 
 
+@timed
 def load_morphology_analogy():
-    return read_mat(DIRNAME_ANALOGY.joinpath("AMfinal_allvolcs_QUET.mat"))["AM_allcross"]
+    return get_backend().read_analogy("morphology")
 
 
+@timed
 def load_eruption_size_analogy():
-    return read_mat(DIRNAME_ANALOGY.joinpath("ASzfinal_allvolcs_SINA.mat"))["ASz_allcross"]
+    return get_backend().read_analogy("eruption_size")
 
 
+@timed
 def load_eruption_style_analogy():
-    return read_mat(DIRNAME_ANALOGY.joinpath("AStfinal_allvolcs_SINA.mat"))["ASt_allcross"]
+    return get_backend().read_analogy("eruption_style")
 
 
+@timed
 def load_volcano_names():
-    return pd.read_csv(DIRNAME_VOLCANO.joinpath("volc_names.csv"), header=None)
+    return get_backend().read_volcano_names()
 
+@timed
 def load_tectonic_data():
-    return read_mat(DIRNAME_DATA.joinpath("ATmatrices.mat"))["ATlast"]
+    return get_backend().read_data("tectonic_setting")
 
+@timed
 def load_geochemistry_data():
-    return read_mat(DIRNAME_DATA.joinpath("AGmatrices_ALU_QUET.mat"))["AGnormmat"]
+    return get_backend().read_data("geochemistry")
 
+@timed
 def load_morphology_data():
-    return read_mat(DIRNAME_DATA.joinpath("AMmatrices_QUET.mat"))["AMlast"]
+    return get_backend().read_data("morphology")
 
+@timed
 def load_eruption_size_data():
-    return read_mat(DIRNAME_DATA.joinpath("ASzmatrices_SINA.mat"))["ASznorm_ALL"]
+    return get_backend().read_data("eruption_size")
 
+@timed
 def load_eruption_style_data():
-    return read_mat(DIRNAME_DATA.joinpath("AStmatrices_SINA.mat"))["AStnormmat"]
+    return get_backend().read_data("eruption_style")
+
+
+class LazyCriteria(Mapping):
+    """
+    Read-only dictionary of volcanological criteria whose values are only
+    loaded from disk the first time that they are accessed.
+
+    Parameters
+    ----------
+    loaders : dict
+        Functions (without arguments) that load the data for each
+        volcanological criterion, keyed by criterion name.
+    """
+
+    def __init__(self, loaders):
+        self._loaders = dict(loaders)
+        self._loaded = {}
+
+    def __getitem__(self, criterion):
+        if criterion not in self._loaded:
+            self._loaded[criterion] = self._loaders[criterion]()
+        return self._loaded[criterion]
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(loaded={list(self._loaded)})"
+
+    def is_loaded(self, criterion):
+        """Return True if the data for the criterion are already in memory."""
+        return criterion in self._loaded
+
+
+def _top_analogues(total_analogy, count):
+    """
+    Indices of the count highest values in each row of an N x N matrix of
+    total analogy, excluding the diagonal (the target volcano itself). Ties
+    are ordered by volcano index.
+    """
+    total_analogy = np.array(total_analogy)
+    np.fill_diagonal(total_analogy, -np.inf)
+    return np.argsort(-total_analogy, axis=1, kind="stable")[:, :count]
+
+
+def verify_analogy_storage(storage, weighting_schemes=None, count=10):
+    """
+    Compares the analogy matrices in a reduced-precision storage type against
+    the float64 originals, for every target volcano.
+
+    Parameters
+    ----------
+    storage : str
+        Storage type to verify (see ANALOGY_STORAGE).
+    weighting_schemes : list of dict, optional
+        Weighting schemes for which the rankings of top analogues are
+        compared. By default the equal-weight scheme and the five
+        single-criterion schemes are used.
+    count : int, optional
+        Number of top analogues compared for each target volcano.
+
+    Returns
+    -------
+    report : dict
+        'max_abs_error': maximum absolute error of the decoded single-
+        criterion analogy values, for each criterion, and of the total
+        analogy values ('total_analogy') over all weighting schemes.
+        'rank_changes': list with one dict per target volcano and weighting
+        scheme where the top analogues (or their order) differ from those
+        obtained with the float64 values, giving the target 'volcano_idx',
+        the 'weights' and both lists of top-analogue indices.
+    """
+    if weighting_schemes is None:
+        weighting_schemes = [dict.fromkeys(CRITERIA, 0.2)]
+        for criterion in CRITERIA:
+            single_criterion = dict.fromkeys(CRITERIA, 0)
+            single_criterion[criterion] = 1
+            weighting_schemes.append(single_criterion)
+
+    originals = {criterion: _load_analogy(criterion, "float64")
+                 for criterion in CRITERIA}
+    encoded = {criterion: matrix.encode(storage)
+               for criterion, matrix in originals.items()}
+
+    report = {"storage": storage, "max_abs_error": {}, "rank_changes": []}
+    for criterion in CRITERIA:
+        error = np.abs(decode_analogies(encoded[criterion].packed) -
+                       originals[criterion].packed)
+        report["max_abs_error"][criterion] = float(error.max())
+
+    total_error = 0.
+    for weights in weighting_schemes:
+        original_total = sum(weights[criterion] * originals[criterion]
+                             for criterion in CRITERIA)
+        encoded_total = sum(weights[criterion] * encoded[criterion]
+                            for criterion in CRITERIA)
+        total_error = max(total_error,
+                          float(np.abs(encoded_total.packed -
+                                       original_total.packed).max()))
+
+        original_top = _top_analogues(original_total.to_dense(), count)
+        encoded_top = _top_analogues(encoded_total.to_dense(), count)
+        for volcano_idx in np.flatnonzero(
+                (original_top != encoded_top).any(axis=1)):
+            report["rank_changes"].append({
+                "volcano_idx": int(volcano_idx),
+                "weights": dict(weights),
+                "float64": original_top[volcano_idx].tolist(),
+                storage: encoded_top[volcano_idx].tolist()})
+    report["max_abs_error"]["total_analogy"] = total_error
+
+    return report
@@ -33,10 +33,23 @@
 """
 # flake8: noqa
 
+# records the start of the import, reported by `pyvolcans --timings`
+from pyvolcans import timings
+
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
+from pyvolcans.VOLCANS_mat_files.base import LazyCriteria
+from pyvolcans.VOLCANS_mat_files.base import SymmetricAnalogyMatrix
+from pyvolcans.VOLCANS_mat_files.base import AnalogyStack
+from pyvolcans.VOLCANS_mat_files.base import SharedAnalogyStore
+from pyvolcans.VOLCANS_mat_files.base import MatBackend
+from pyvolcans.VOLCANS_mat_files.base import NpyBackend
+from pyvolcans.VOLCANS_mat_files.base import HDF5Backend
+from pyvolcans.VOLCANS_mat_files.base import get_backend
+from pyvolcans.VOLCANS_mat_files.base import set_backend
+from pyvolcans.VOLCANS_mat_files.base import load_analogy_stack
 from pyvolcans.VOLCANS_mat_files.base import load_volcano_names
 from pyvolcans.VOLCANS_mat_files.base import load_tectonic_analogy
 from pyvolcans.VOLCANS_mat_files.base import load_geochemistry_analogy
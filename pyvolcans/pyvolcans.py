@@ -11,13 +11,15 @@ Created on Mon Feb 17 12:13:20 2020
 
 # standard packages
 import argparse
+import atexit
 import logging
 import sys, io
+import time
 from pathlib import Path
-import matplotlib.pyplot as plt
 import json
 
 # our packages
+from pyvolcans.timings import IMPORT_START, TIMER
 from pyvolcans.pyvolcans_func import (
     _frac_to_float,
     calculate_weighted_analogy_matrix,
@@ -68,6 +70,7 @@ def cli():
         open the website cannot be identified. Code execution is NOT terminated
         after encountering this issue.
     """
+    cli_start = time.perf_counter()
 
     # setup logging
     formatter = logging.Formatter('PyVOLCANS: %(message)s')
@@ -78,6 +81,13 @@ def cli():
     # get the arguments
     args = parse_args()
 
+    TIMER.enabled = args.timings
+    if args.timings:
+        TIMER.record('package import', cli_start - IMPORT_START, first=True)
+        TIMER.start_memory_tracing()
+        # report when the program ends, whether successfully or on error
+        atexit.register(_print_timings)
+
     # get volcano_name from volcano arg
     try:
         volcano_input = int(args.volcano)
@@ -116,15 +126,21 @@ def cli():
     # call PyVOLCANS
     try:
         # main PyVOLCANS result for all volcanoes (and weighting scheme used)
+        # NB. The result is kept as arrays, and only the rows shown are
+        # converted to a dataframe
         volcans_result = \
             calculate_weighted_analogy_matrix(volcano_input,
-                                              weights=new_weights)
+                                              weights=new_weights,
+                                              as_frame=False)
 
         # final PyVOLCANS result (specific of the target volcano selected)
+        # NB. The top analogues are read from a pre-built table if there is
+        # one for the weighting scheme (e.g. for equal weights)
         [top_analogues,
          volcano_name] = get_analogies(volcano_input,
                                        volcans_result,
-                                       count)
+                                       count,
+                                       weights=new_weights)
 
         # check for 'too many perfect analogues' (see Tierz et al., 2019)
         warn_on_perfect_analogues(result=top_analogues)
@@ -208,7 +224,8 @@ def cli():
             [my_percentiles, my_better_analogues] = \
                 get_many_analogy_percentiles(volcano_input,
                                              my_apriori_volcanoes,
-                                             volcans_result)
+                                             volcans_result,
+                                             weights=new_weights)
             # NB. This code is only run when 1+ 'a priori' analogues are given
             if args.plot_apriori:
                 plot_bar_apriori_analogues(volcano_name, my_volcano_vnum,
@@ -222,13 +239,20 @@ def cli():
                                           save_figure=args.save_figures)
 
         # displaying all figures just before the end of the script
-        plt.show()
+        # NB. matplotlib is only imported if some figures have been plotted
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].show()
     except PyvolcansError as exc:
         # print error message and quit program on error
         logging.error(exc.args[0])
         sys.exit(1)
 
 
+def _print_timings():
+    """Prints the timings of all the stages run by PyVOLCANS to stderr."""
+    print(f'\n{TIMER.report()}', file=sys.stderr)
+
+
 def parse_args():
     """
     Reads PyVOLCANS arguments from command line and returns values
@@ -299,6 +323,12 @@ def parse_args():
                         )
     parser.add_argument("-S", "--save_figures", action="store_true",
                         help="Save all generated figures")
+    parser.add_argument("--timings", action="store_true",
+                        help=("Print the wall time and peak memory of each "
+                              "processing stage (package import, data "
+                              "loading, name resolution, analogy "
+                              "calculation, output and plotting)")
+                        )
     parser.add_argument("-V", "--version", action="version",
                         help="Print PyVOLCANS package version and exit",
                         version=__version__)
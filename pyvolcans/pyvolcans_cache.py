@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to inspect, warm or purge the cache of data that
+PyVOLCANS derives from the VOLCANS source files.
+
+@author: Pablo Tierz, John A. Stevenson, Vyron Christodoulou
+         (British Geological Survey, The Lyell Centre,
+         Edinburgh, UK).
+"""
+import argparse
+
+from pyvolcans.VOLCANS_mat_files.base import (
+    ANALOGY_STORAGE,
+    get_bundle,
+    get_cache_dir,
+    get_source_key,
+    get_source_manifest,
+    list_artefacts,
+)
+
+
+def cli():
+    """
+    Command line interface to manage the PyVOLCANS cache.
+
+    Subcommands
+    -----------
+    info
+        Prints the cache directory, the content hash of each source file and
+        the cached files, marking those built from older source files.
+    warm
+        Builds the cached data bundles, so that the first run of PyVOLCANS
+        does not have to.
+    purge
+        Removes the cached files (only the stale ones with `--stale`).
+    """
+    args = parse_args()
+    args.func(args)
+
+
+def info(args):
+    """Prints the state of the cache."""
+    manifest = get_source_manifest(rehash=args.rehash)
+    source_key = get_source_key(manifest)
+
+    print(f"Cache directory: {get_cache_dir()}")
+    print(f"Source key: {source_key}\n")
+    print("Source files:")
+    for name, entry in manifest.items():
+        print(f"  {entry['sha256'][:16]}  {entry['size']:>10}  {name}")
+
+    print("\nCached files:")
+    artefacts = list_artefacts(source_key)
+    if not artefacts:
+        print("  (none)")
+    for path, is_current in artefacts:
+        status = 'current' if is_current else 'stale'
+        print(f"  {status:<8}{path.stat().st_size:>12}  {path.name}")
+
+
+def warm(args):
+    """Builds the data bundles for the selected storage types."""
+    for storage in args.storage:
+        get_bundle(storage)
+        print(f"Data bundle ready ({storage})")
+
+
+def purge(args):
+    """Removes cached files."""
+    for path, is_current in list_artefacts():
+        if args.stale and is_current:
+            continue
+        path.unlink()
+        print(f"Removed {path.name}")
+
+
+def parse_args():
+    """
+    Reads pyvolcans-cache arguments from command line.
+
+    Parameters
+    ----------
+    Please type: `$ pyvolcans-cache --help` to display all parameters
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="pyvolcans-cache",
+        description="Inspect, warm or purge the PyVOLCANS data cache")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    info_parser = subparsers.add_parser(
+        "info", help="Show source file hashes and cached files")
+    info_parser.add_argument("--rehash", action="store_true",
+                             help="Recompute the hashes of all source files")
+    info_parser.set_defaults(func=info)
+
+    warm_parser = subparsers.add_parser(
+        "warm", help="Build the cached data bundles")
+    warm_parser.add_argument("--storage", nargs='+', default=['float64'],
+                             choices=list(ANALOGY_STORAGE),
+                             help="Storage type(s) of the analogy values")
+    warm_parser.set_defaults(func=warm)
+
+    purge_parser = subparsers.add_parser(
+        "purge", help="Remove cached files")
+    purge_parser.add_argument("--stale", action="store_true",
+                              help=("Only remove files built from older "
+                                    "versions of the source files"))
+    purge_parser.set_defaults(func=purge)
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to export PyVOLCANS results for all volcanoes in the GVP
+database at once, e.g. for clustering or GIS analyses.
+
+@author: Pablo Tierz, John A. Stevenson, Vyron Christodoulou
+         (British Geological Survey, The Lyell Centre,
+         Edinburgh, UK).
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from pyvolcans.pyvolcans_func import (
+    TOP_ANALOGUES_COUNT,
+    PyvolcansError,
+    _frac_to_float,
+    build_top_analogue_table,
+    export_total_analogy_matrix,
+    get_top_analogue_table,
+    set_weights_from_args,
+    weights_to_array,
+)
+from pyvolcans.VOLCANS_mat_files.base import (
+    TopAnalogueTable,
+    get_analogy_storage,
+    get_source_key,
+    get_top_analogues_stem,
+    load_analogy_stack,
+)
+
+
+def cli():
+    """
+    Command line interface to export PyVOLCANS results.
+
+    Subcommands
+    -----------
+    matrix
+        Writes the N x N matrix of total analogy between every pair of
+        volcanoes, for the selected weighting scheme, to a .npy or HDF5 file.
+    topk
+        Builds the table of top analogues of every volcano for the selected
+        weighting scheme, which is then used by pyvolcans for that scheme.
+    """
+    # setup logging
+    formatter = logging.Formatter('PyVOLCANS: %(message)s')
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logging.basicConfig(handlers=[handler], level=logging.INFO)
+
+    args = parse_args()
+    try:
+        args.func(args)
+    except PyvolcansError as exc:
+        logging.error(exc.args[0])
+        sys.exit(1)
+
+
+def get_weights(args):
+    """Returns the weighting scheme given with the criterion flags."""
+    arg_weights = {'tectonic_setting': _frac_to_float(args.tectonic_setting),
+                   'geochemistry': _frac_to_float(args.rock_geochemistry),
+                   'morphology': _frac_to_float(args.morphology),
+                   'eruption_size': _frac_to_float(args.eruption_size),
+                   'eruption_style': _frac_to_float(args.eruption_style)}
+    return set_weights_from_args(arg_weights)
+
+
+def matrix(args):
+    """Writes the total analogy matrix."""
+    weights = get_weights(args)
+    logging.info("Exporting total analogy matrix with weights: %s", weights)
+    export_total_analogy_matrix(args.output, weights,
+                                block_size=args.block_size)
+    print(f"Total analogy matrix written to {args.output}")
+
+
+def topk(args):
+    """Builds a table of top analogues."""
+    weights = weights_to_array(get_weights(args))
+    if args.output_dir is None:
+        table = get_top_analogue_table(weights, build=True, count=args.count)
+        if table is None:
+            raise PyvolcansError("Tables of top analogues are only used with "
+                                 "the default data backend ('mat')")
+        print(f"Table of top analogues ready for weights {weights.tolist()} "
+              f"(top {table.count})")
+        return
+
+    # NB. Tables are always built from the data bundle (see MatBackend)
+    storage = get_analogy_storage()
+    top_indices, top_values = build_top_analogue_table(
+        weights, args.count, analogies=load_analogy_stack(storage))
+    filename = Path(args.output_dir) / \
+        f'{get_top_analogues_stem(weights, storage)}.bin'
+    TopAnalogueTable.write(filename, top_indices, top_values, weights,
+                           get_source_key(), storage)
+    print(f"Table of top analogues written to {filename}")
+
+
+def add_weight_arguments(parser):
+    """Adds the flags that set the weight of each criterion to parser."""
+    parser.add_argument("-Ts", "--tectonic_setting", action='append',
+                        help="Set tectonic setting weight (e.g. '0.2' or '1/5')",
+                        default=None, type=str)
+    parser.add_argument("-G", "--rock_geochemistry", action='append',
+                        help="Set rock geochemistry weight (e.g. '0.2' or '1/5')",
+                        default=None, type=str)
+    parser.add_argument("-M", "--morphology", action='append',
+                        help="Set volcano morphology weight (e.g. '0.2' or '1/5')",
+                        default=None, type=str)
+    parser.add_argument("-Sz", "--eruption_size", action='append',
+                        help="Set eruption size weight (e.g. '0.2' or '1/5')",
+                        default=None, type=str)
+    parser.add_argument("-St", "--eruption_style", action='append',
+                        help="Set eruption style weight (e.g. '0.2' or '1/5')",
+                        default=None, type=str)
+
+
+def parse_args():
+    """
+    Reads pyvolcans-export arguments from command line.
+
+    Parameters
+    ----------
+    Please type: `$ pyvolcans-export --help` to display all parameters
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="pyvolcans-export",
+        description="Export PyVOLCANS results for all volcanoes")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    matrix_parser = subparsers.add_parser(
+        "matrix", help="Write the N x N matrix of total analogy")
+    matrix_parser.add_argument("output",
+                               help="Output file (.npy, .h5 or .hdf5)")
+    add_weight_arguments(matrix_parser)
+    matrix_parser.add_argument("--block-size", default=128, type=int,
+                               help=("Number of rows of the matrix calculated "
+                                     "at a time (bounds the memory used)"))
+    matrix_parser.set_defaults(func=matrix)
+
+    topk_parser = subparsers.add_parser(
+        "topk", help="Build the table of top analogues of all volcanoes")
+    add_weight_arguments(topk_parser)
+    topk_parser.add_argument("--count", default=TOP_ANALOGUES_COUNT,
+                             type=int,
+                             help="Number of top analogues per volcano")
+    topk_parser.add_argument("--output-dir", default=None,
+                             help=("Write the table to this directory "
+                                   "instead of the cache directory"))
+    topk_parser.set_defaults(func=topk)
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    cli()
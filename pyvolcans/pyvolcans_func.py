@@ -9,15 +9,21 @@ Created on Tue Mar  3 09:49:16 2020
          Edinburgh, UK).
 """
 import warnings
-import webbrowser
+from collections import OrderedDict
 from fractions import Fraction
 import json
+from pathlib import Path
 
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
-from pyvolcans import (load_tectonic_analogy,
+from pyvolcans import (AnalogyStack,
+                       get_backend,
+                       LazyCriteria,
+                       load_analogy_stack,
+                       MatBackend,
+                       SharedAnalogyStore,
+                       load_tectonic_analogy,
                        load_geochemistry_analogy,
                        load_morphology_analogy,
                        load_eruption_size_analogy,
@@ -28,6 +34,14 @@ from pyvolcans import (load_tectonic_analogy,
                        load_morphology_data,
                        load_eruption_size_data,
                        load_eruption_style_data)
+from pyvolcans.timings import timed
+from pyvolcans.VOLCANS_mat_files.base import (CRITERIA,
+                                              TopAnalogueTable,
+                                              find_top_analogue_table,
+                                              get_analogy_order_index,
+                                              get_analogy_storage,
+                                              get_source_key,
+                                              get_top_analogues_path)
 
 
 # Define custom message formatter for warnings
@@ -42,36 +56,80 @@ def _format_pyvolcans_warning(message, *args, **kwargs):
 # Replace built-in warning format function
 warnings.formatwarning = _format_pyvolcans_warning
 
-# thefuzz would like to use a sequence matcher provided by the
-# Python-Levenshtein package, but this has dependencies that require
-# compilation.  When it is not installed, it uses the matcher provided
-# by the standard library difflib and raises a warning.  In our case
-# it doesn't make much difference so we suppress the warning.
-with warnings.catch_warnings():
-    warnings.filterwarnings('ignore',
-                            message="Using slow pure-python SequenceMatcher.")
-    from thefuzz import fuzz, process
-
 VOLCANO_NAMES = load_volcano_names()
 
+# names, countries and volcano numbers (VNUM) used in the PyVOLCANS results,
+# shared by all AnalogyResult objects (it must not be modified)
+RESULT_NAMES = VOLCANO_NAMES.set_axis(['name', 'country', 'smithsonian_id'],
+                                      axis=1)
+
+
+def build_volcano_lookups(volcano_names):
+    """
+    Builds dictionaries to look up volcanoes in the table of volcano names,
+    so that volcano names and numbers are resolved without scanning it.
+
+    Parameters
+    ----------
+    volcano_names : Pandas dataframe
+        Volcano names, countries and volcano numbers (VNUM), as returned by
+        load_volcano_names.
+
+    Returns
+    -------
+    idx_by_name : dict
+        Indices (list of int) of the volcanoes with each name. Names shared
+        by several volcanoes have more than one index.
+    idx_by_number : dict
+        Index of the volcano with each volcano number (VNUM).
+    volcano_info : list of tuple
+        Name, country and volcano number of the volcano with each index.
+    """
+    volcano_info = list(zip(volcano_names[0], volcano_names[1],
+                            volcano_names[2]))
+    idx_by_name = {}
+    idx_by_number = {}
+    for idx, (name, _, vnum) in zip(volcano_names.index, volcano_info):
+        idx_by_name.setdefault(name, []).append(idx)
+        idx_by_number.setdefault(vnum, idx)
+
+    return idx_by_name, idx_by_number, volcano_info
+
+
+VOLCANO_IDX_BY_NAME, VOLCANO_IDX_BY_NUMBER, VOLCANO_INFO = \
+    build_volcano_lookups(VOLCANO_NAMES)
+
 # dictionary of weights for the volcanological criteria
 WEIGHTS = {'tectonic_setting': 0.2, 'geochemistry': 0.2,
            'morphology': 0.2, 'eruption_size': 0.2, 'eruption_style': 0.2}
 
-# load all the analogy data from VOLCANS
-ANALOGY_MATRIX = {'tectonic_setting': load_tectonic_analogy(),
-                  'geochemistry': load_geochemistry_analogy(),
-                  'morphology': load_morphology_analogy(),
-                  'eruption_size': load_eruption_size_analogy(),
-                  'eruption_style': load_eruption_style_analogy()
-                  }
-
-# load the underlying volcano data
-VOLCANO_DATA = {'tectonic_setting': load_tectonic_data(),
-                'geochemistry': load_geochemistry_data(),
-                'morphology': load_morphology_data(),
-                'eruption_size': load_eruption_size_data(),
-                'eruption_style': load_eruption_style_data()}
+# analogy data from VOLCANS (each criterion is loaded on first access)
+ANALOGY_MATRIX = LazyCriteria({'tectonic_setting': load_tectonic_analogy,
+                               'geochemistry': load_geochemistry_analogy,
+                               'morphology': load_morphology_analogy,
+                               'eruption_size': load_eruption_size_analogy,
+                               'eruption_style': load_eruption_style_analogy})
+
+# underlying volcano data (each criterion is loaded on first access)
+VOLCANO_DATA = LazyCriteria({'tectonic_setting': load_tectonic_data,
+                             'geochemistry': load_geochemistry_data,
+                             'morphology': load_morphology_data,
+                             'eruption_size': load_eruption_size_data,
+                             'eruption_style': load_eruption_style_data})
+
+# command-line flags used to set the weight of each volcanological criterion
+CRITERIA_FLAGS = {'tectonic_setting': '-Ts', 'geochemistry': '-G',
+                  'morphology': '-M', 'eruption_size': '-Sz',
+                  'eruption_style': '-St'}
+
+# number of top analogues stored for each volcano in the tables of top
+# analogues (see build_top_analogue_table)
+TOP_ANALOGUES_COUNT = 100
+
+# columns of the PyVOLCANS result with the single-criterion analogy values
+ANALOGY_COLUMNS = {'tectonic_setting': 'ATs', 'geochemistry': 'AG',
+                   'morphology': 'AM', 'eruption_size': 'ASz',
+                   'eruption_style': 'ASt'}
 
 def _frac_to_float(value):
     """
@@ -150,6 +208,147 @@ def format_volcano_name(volcano_name, volcano_vnum):
     return volcano_name_joined
 
 
+def _import_thefuzz():
+    """
+    Imports thefuzz, which is only needed when a volcano name is not found
+    and is therefore not imported with the rest of PyVOLCANS.
+    """
+    # thefuzz would like to use a sequence matcher provided by the
+    # Python-Levenshtein package, but this has dependencies that require
+    # compilation.  When it is not installed, it uses the matcher provided
+    # by the standard library difflib and raises a warning.  In our case
+    # it doesn't make much difference so we suppress the warning.
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore',
+                                message="Using slow pure-python SequenceMatcher.")
+        from thefuzz import fuzz, process
+
+    return fuzz, process
+
+
+class VolcanoNameIndex:
+    """
+    Character-trigram inverted index of the normalised volcano names (as
+    compared by fuzz.token_sort_ratio: processed by thefuzz, with tokens
+    sorted), used by fuzzy_matching to score a short list of names instead
+    of all of them.
+
+    The candidates returned by candidates() always include every name that
+    could be among the best matches. The names with most trigrams in common
+    with the query are scored first, and any other name whose score could
+    reach theirs is then added, using an upper bound of the score from the
+    characters in common (the longest common subsequence of two strings can
+    not be longer than their common characters).
+
+    Parameters
+    ----------
+    names : Pandas series
+        Volcano names.
+    shortlist : int, optional
+        Number of names shortlisted by trigrams.
+    """
+
+    def __init__(self, names, shortlist=50):
+        self.names = names
+        self.shortlist = shortlist
+        self.fuzz, self.process = _import_thefuzz()
+        from thefuzz import utils
+        self.utils = utils
+
+        normalised_names = [self._normalise(name, force_ascii=True)
+                            for name in names]
+        postings = {}
+        for position, name in enumerate(normalised_names):
+            for trigram in set(self._trigrams(name)):
+                postings.setdefault(trigram, []).append(position)
+        self.postings = {trigram: np.array(positions)
+                         for trigram, positions in postings.items()}
+        self.trigram_counts = np.array([len(set(self._trigrams(name)))
+                                        for name in normalised_names])
+
+        # characters of each normalised name, for the bounds of the scores
+        self.characters = {character: i for i, character in enumerate(
+            sorted(set(''.join(normalised_names))))}
+        self.character_counts = np.zeros((len(names), len(self.characters)),
+                                         dtype=np.int16)
+        for position, name in enumerate(normalised_names):
+            for character in name:
+                self.character_counts[position,
+                                      self.characters[character]] += 1
+        self.lengths = np.array([len(name) for name in normalised_names])
+
+    def _normalise(self, text, force_ascii=False):
+        tokens = self.utils.full_process(text, force_ascii=force_ascii).split()
+        return ' '.join(sorted(tokens))
+
+    @staticmethod
+    def _trigrams(text):
+        padded = f"  {text} "
+        return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    def upper_bounds(self, normalised_query):
+        """
+        Returns, for every name, the highest token_sort_ratio score that it
+        could have with the (normalised) query.
+        """
+        query_counts = np.zeros(len(self.characters), dtype=np.int16)
+        for character in normalised_query:
+            if character in self.characters:
+                query_counts[self.characters[character]] += 1
+        common = np.minimum(self.character_counts, query_counts).sum(axis=1)
+        return 200 * common / (len(normalised_query) + self.lengths)
+
+    def candidates(self, volcano_name, limit=10):
+        """
+        Returns the positions (sorted) of the names that may be among the
+        limit best matches of volcano_name.
+        """
+        normalised_query = self._normalise(volcano_name)
+        # NB. Queries that thefuzz could process in different ways (with
+        # non-ASCII characters) or that are empty are matched against all
+        # names
+        if (not normalised_query
+                or normalised_query != self._normalise(volcano_name,
+                                                       force_ascii=True)
+                or limit >= self.shortlist):
+            return np.arange(len(self.names))
+
+        # shortlist the names with most trigrams in common with the query
+        query_trigrams = set(self._trigrams(normalised_query))
+        hits = np.zeros(len(self.names))
+        for trigram in query_trigrams:
+            if trigram in self.postings:
+                hits[self.postings[trigram]] += 1
+        similarity = 2 * hits / (len(query_trigrams) + self.trigram_counts)
+        shortlist = np.argsort(-similarity, kind='stable')[:self.shortlist]
+
+        # score the shortlist, and add any name that could score as high as
+        # the limit-th best score found (scores are rounded to integers)
+        matches = self.process.extract(volcano_name,
+                                       self.names.iloc[np.sort(shortlist)],
+                                       limit=limit,
+                                       scorer=self.fuzz.token_sort_ratio)
+        lowest_score = matches[-1][1] - 0.5 - 1e-6
+        could_match = self.upper_bounds(normalised_query) >= lowest_score
+        could_match[shortlist] = True
+
+        return np.flatnonzero(could_match)
+
+
+_VOLCANO_NAME_INDEX = None
+
+
+def get_volcano_name_index():
+    """
+    Returns the VolcanoNameIndex of the volcano names, which is built the
+    first time that it is needed.
+    """
+    global _VOLCANO_NAME_INDEX
+    if _VOLCANO_NAME_INDEX is None:
+        _VOLCANO_NAME_INDEX = VolcanoNameIndex(VOLCANO_NAMES[0])
+    return _VOLCANO_NAME_INDEX
+
+
 def fuzzy_matching(volcano_name, limit=10):
     """
     Provides a list of volcanoes with names most similar to volcano_name.
@@ -169,10 +368,7 @@ def fuzzy_matching(volcano_name, limit=10):
     similar_volcano_names : str
         List of volcanoes with similar names to the target volcano
     """
-    matches = process.extract(volcano_name, VOLCANO_NAMES[0], limit=limit,
-                              scorer=fuzz.token_sort_ratio)
-
-    match_idx = [item[2] for item in matches]
+    match_idx = get_similar_volcano_idx(volcano_name, limit)
     volcano_info = \
         VOLCANO_NAMES.iloc[match_idx].rename(columns={0: 'name',
                                                       1: 'country',
@@ -182,6 +378,21 @@ def fuzzy_matching(volcano_name, limit=10):
     return similar_volcano_names
 
 
+def get_similar_volcano_idx(volcano_name, limit=10):
+    """
+    Returns the indices of the volcanoes with names most similar to
+    volcano_name, from most to least similar (see fuzzy_matching).
+    """
+    fuzz, process = _import_thefuzz()
+    # only score the names that may be among the best matches (see
+    # VolcanoNameIndex), which gives the same matches as scoring all names
+    candidates = get_volcano_name_index().candidates(volcano_name, limit)
+    matches = process.extract(volcano_name, VOLCANO_NAMES[0].iloc[candidates],
+                              limit=limit, scorer=fuzz.token_sort_ratio)
+
+    return [item[2] for item in matches]
+
+
 def get_volcano_idx_from_number(volcano_number):
     """
     Derives the index of the volcano in the analogy matrices (VOLCANS) from the
@@ -201,15 +412,14 @@ def get_volcano_idx_from_number(volcano_number):
         If the VNUM introduced does not exist
     """
 
-    volcano_idx = VOLCANO_NAMES.loc[VOLCANO_NAMES[2] == volcano_number]
-    if volcano_idx.empty:
+    try:
+        volcano_index = VOLCANO_IDX_BY_NUMBER[volcano_number]
+    except (KeyError, TypeError):
         msg = ("Volcano number does not exist. "
                "Please provide a non-zero, positive, six digits number. To check for "
                "existing volcano numbers (VNUM), please visit www.volcano.si.edu")
         raise PyvolcansError(msg)
 
-    volcano_index = volcano_idx.index[0]
-
     return volcano_index
 
 
@@ -233,8 +443,7 @@ def get_volcano_idx_from_name(volcano_name):
         name cannot be matched to a volcano index
     """
 
-    matched_volcanoes = match_name(volcano_name)
-    volcano_index = matched_volcanoes.index[0]
+    volcano_index = _match_name_indices(volcano_name)[0]
 
     return volcano_index
 
@@ -258,8 +467,11 @@ def get_volcano_name_from_idx(volcano_idx):
     N is the number of Holocene volcanoes in the GVP database, v. 4.6.7)
     """
 
-    volcano_name = \
-        VOLCANO_NAMES.iloc[volcano_idx, 0]
+    if np.ndim(volcano_idx) == 0:
+        volcano_name = VOLCANO_INFO[volcano_idx][0]
+    else:
+        # several indices give a Pandas series of names
+        volcano_name = VOLCANO_NAMES.iloc[volcano_idx, 0]
 
     return volcano_name
 
@@ -284,11 +496,12 @@ def get_volcano_number_from_name(volcano_name):
         name cannot be matched to a volcano number (VNUM)
     """
 
-    matched_volcanoes = match_name(volcano_name)
-    volcano_vnum = matched_volcanoes.iloc[0, 2]
+    volcano_idx = _match_name_indices(volcano_name)[0]
+    volcano_vnum = VOLCANO_INFO[volcano_idx][2]
     return volcano_vnum
 
 
+@timed
 def convert_to_idx(my_volcano):
     """
     Checks whether the volcano input is a string or not, and in either case,
@@ -320,6 +533,147 @@ def convert_to_idx(my_volcano):
     return volcano_idx
 
 
+class VolcanoResolutionReport:
+    """
+    Volcanoes that resolve_volcanoes could not resolve to a single volcano
+    index. Each problem is a dictionary with the position of the volcano in
+    the list given, the volcano as given ('volcano'), the problem ('not
+    found' or 'not unique') and the indices of the volcanoes sharing the
+    name ('matches', for names that are not unique).
+
+    Suggestions of similar volcano names, as in the messages of match_name,
+    are only calculated when requested (see suggestions()).
+
+    Parameters
+    ----------
+    problems : list of dict
+        Volcanoes not resolved, in the order of the list given.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        self._suggestions = {}
+
+    @property
+    def unresolved(self):
+        """Volcanoes that were not found."""
+        return [problem for problem in self.problems
+                if problem['problem'] == 'not found']
+
+    @property
+    def ambiguous(self):
+        """Volcano names shared by more than one volcano."""
+        return [problem for problem in self.problems
+                if problem['problem'] == 'not unique']
+
+    def suggestions(self, position, limit=10):
+        """
+        Returns a Pandas dataframe with the volcanoes with names most similar
+        to the volcano at the given position of the list given (see
+        fuzzy_matching). Volcano numbers that were not found have no
+        suggestions.
+        """
+        problem = next(problem for problem in self.problems
+                       if problem['position'] == position)
+        volcano = problem['volcano']
+        if not isinstance(volcano, str):
+            return RESULT_NAMES.iloc[[]]
+        if (volcano, limit) not in self._suggestions:
+            self._suggestions[(volcano, limit)] = \
+                RESULT_NAMES.iloc[get_similar_volcano_idx(volcano, limit)]
+        return self._suggestions[(volcano, limit)]
+
+    def to_frame(self):
+        """Returns the problems as a Pandas dataframe."""
+        return pd.DataFrame(self.problems,
+                            columns=['position', 'volcano', 'problem',
+                                     'matches'])
+
+    def __len__(self):
+        return len(self.problems)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(unresolved={len(self.unresolved)}, "
+                f"ambiguous={len(self.ambiguous)})")
+
+
+@timed
+def resolve_volcanoes(volcanoes):
+    """
+    Derives the indices of many volcanoes, given as volcano names or volcano
+    numbers (VNUM), in a single pass over the lookups of names and numbers,
+    instead of calling convert_to_idx for each of them. Volcanoes that cannot
+    be resolved do not raise an exception but are listed in a report.
+
+    Parameters
+    ----------
+    volcanoes : list of str or int
+        Volcanoes, as volcano names or volcano numbers
+
+    Returns
+    -------
+    volcano_indices : array of int
+        Index of each volcano in the analogy matrices (VOLCANS), or -1 for
+        the volcanoes that were not found or whose name is not unique.
+    report : VolcanoResolutionReport
+        Volcanoes that were not found or whose name is not unique.
+    """
+    volcano_indices = np.full(len(volcanoes), -1, dtype=int)
+    problems = []
+    for position, volcano in enumerate(volcanoes):
+        try:
+            if isinstance(volcano, str):
+                matched_idx = VOLCANO_IDX_BY_NAME.get(volcano, [])
+            else:
+                matched_idx = [VOLCANO_IDX_BY_NUMBER[volcano]]
+        except (KeyError, TypeError):
+            matched_idx = []
+
+        if len(matched_idx) == 1:
+            volcano_indices[position] = matched_idx[0]
+        else:
+            problems.append({'position': position, 'volcano': volcano,
+                             'problem': ('not unique' if matched_idx
+                                         else 'not found'),
+                             'matches': matched_idx})
+
+    return volcano_indices, VolcanoResolutionReport(problems)
+
+
+def resolve_targets(targets):
+    """
+    Derives the indices of many target volcanoes (see resolve_volcanoes),
+    raising a single error that lists all the volcanoes that could not be
+    resolved.
+
+    Parameters
+    ----------
+    targets : list of str or int
+        Target volcanoes, as volcano names or volcano numbers
+
+    Returns
+    -------
+    volcano_indices : array of int
+
+    Raises
+    ------
+    PyvolcansError
+        If any volcano name or number does not exist, or any volcano name
+        is not unique.
+    """
+    volcano_indices, report = resolve_volcanoes(targets)
+    if report.problems:
+        problems_text = ', '.join(f"{problem['volcano']} ({problem['problem']})"
+                                  for problem in report.problems)
+        msg = (f"The following target volcanoes could not be resolved: "
+               f"{problems_text}. Please check the volcano names and "
+               "numbers (VNUM), and provide the volcano number for volcano "
+               "names that are not unique.")
+        raise PyvolcansError(msg)
+
+    return volcano_indices
+
+
 def set_weights_from_args(args_dict):
     """
     Transforms the set of weights, for volcanological criteria, introduced by
@@ -385,8 +739,77 @@ def set_weights_from_args(args_dict):
     return args_dict
 
 
+def validate_weights_array(weights):
+    """
+    Checks many weighting schemes at once, with the same rules as
+    set_weights_from_args: no weight can be negative and the weights of each
+    scheme must sum up to one.
+
+    Parameters
+    ----------
+    weights : array-like
+        Weighting schemes, with shape (W, 5) and weights in the order of
+        CRITERIA (a single scheme of shape (5,) or a dict is also accepted)
+
+    Returns
+    -------
+    weights_array : array
+        Weighting schemes as floats, with shape (W, 5).
+
+    Raises
+    ------
+    PyvolcansError
+        If any criterion weight is negative, or if the sum of weights of any
+        weighting scheme is different from one (with a precision of 1e-9).
+        The message lists the (zero-based) rows of the offending schemes.
+    """
+    weights_array = np.atleast_2d(weights_to_array(weights))
+    if weights_array.ndim != 2:
+        msg = (f"Weighting schemes must be given as an array of shape "
+               f"(W, {len(CRITERIA)})")
+        raise PyvolcansError(msg)
+
+    negative_rows = np.flatnonzero((weights_array < 0).any(axis=1))
+    if negative_rows.size:
+        msg = ("Some criterion weights are negative values! "
+               "Please revise your weighting scheme(s) "
+               f"{_format_rows(negative_rows)}.")
+        raise PyvolcansError(msg)
+
+    sum_of_weights = weights_array.sum(axis=1)
+    wrong_sum_rows = np.flatnonzero(
+        ~np.isclose(sum_of_weights, 1, rtol=0, atol=1e-9))
+    if wrong_sum_rows.size:
+        msg = (f"Sum of weights ({sum_of_weights[wrong_sum_rows[0]]:.9f}) is "
+               "different from 1! Please revise your weighting scheme(s) "
+               f"{_format_rows(wrong_sum_rows)}.")
+        raise PyvolcansError(msg)
+
+    return weights_array
+
+
+def _format_rows(rows, limit=10):
+    """Lists the first row numbers of an array, for error messages."""
+    text = ', '.join(str(row) for row in rows[:limit])
+    if len(rows) > limit:
+        text += f' (and {len(rows) - limit} more)'
+    return text
+
+
+def _uses_bundle_data(analogies):
+    """
+    Returns True if analogies are the default analogy matrices and they are
+    read from the data bundle (see MatBackend), i.e. the data described by
+    the tables of top analogues and the precomputed indices.
+    """
+    return analogies is ANALOGY_MATRIX and isinstance(get_backend(),
+                                                      MatBackend)
+
+
+@timed
 def calculate_weighted_analogy_matrix(my_volcano, weights,
-                                      analogies=ANALOGY_MATRIX):
+                                      analogies=ANALOGY_MATRIX,
+                                      as_frame=True):
     """
     Derives a matrix of total and single-criterion analogy values between the
     target volcano and any other volcano in the GVP database
@@ -396,16 +819,25 @@ def calculate_weighted_analogy_matrix(my_volcano, weights,
     ----------
     my_volcano : str or int
         Target volcano selected by the user, as volcano name or volcano number
-    weights : dict
-        Set of weights (weighting scheme) selected by the user to run PyVOLCANS
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
     analogies: dict (fixed keyword argument)
         Cross-volcano values of single-criterion analogy between any two
         volcanoes listed in the GVP database (v. 4.6.7), for five different
-        volcanological criteria (see Tierz et al., 2019, for more details)
+        volcanological criteria (see Tierz et al., 2019, for more details).
+        Matrices may be NumPy arrays or SymmetricAnalogyMatrix objects, or
+        all of them may be given as an AnalogyStack, whose rows are read
+        with a single gather. A SharedAnalogyStore can also be given, to use the analogy matrices
+        published in shared memory.
+    as_frame : bool, optional
+        If False, the result is returned as an AnalogyResult, which keeps the
+        analogy values as arrays and only builds a Pandas dataframe for the
+        rows that are requested (e.g. the top analogues).
 
     Returns
     -------
-    volcans_result : Pandas dataframe
+    volcans_result : Pandas dataframe or AnalogyResult
         Total and single-criterion analogy values between the target volcano
         and any volcano listed in the GVP database (v. 4.6.7)
 
@@ -414,69 +846,820 @@ def calculate_weighted_analogy_matrix(my_volcano, weights,
         particular run of PyVOLCANS. A different weighting scheme can generate
         an entirely different set of total analogy values.
     """
+    weighted_analogies, weighted_total_analogy = \
+        calculate_weighted_analogy_rows(my_volcano, weights, analogies)
+
+    # NB. The weights are only kept when the result was calculated from the
+    # data bundle, as they let other functions reuse the tables of top
+    # analogues and the results cached for the same data
+    volcano_idx = convert_to_idx(my_volcano)
+    result_weights = None
+    if _uses_bundle_data(analogies):
+        result_weights = weights_to_array(weights)
+        ANALOGY_CACHE.put(volcano_idx, result_weights, weighted_total_analogy)
+    volcans_result = AnalogyResult(
+        weighted_total_analogy, weighted_analogies,
+        volcano_idx=volcano_idx, weights=result_weights)
+
+    # arrange final result
+    if as_frame:
+        volcans_result = volcans_result.to_frame()
+
+    return volcans_result
+
+
+class AnalogyResult:
+    """
+    Total and single-criterion analogy values between a target volcano and
+    the volcanoes in the GVP database, kept as NumPy arrays together with a
+    reference to the shared table of volcano names (RESULT_NAMES). A Pandas
+    dataframe with the same columns as the result of
+    calculate_weighted_analogy_matrix is only built when requested, and only
+    for the rows requested (see to_frame).
+
+    AnalogyResult objects can be given to get_analogies,
+    get_analogy_percentile, get_many_analogy_percentiles, output_result and
+    plot_bar_apriori_analogues in place of the dataframe. Indexing with a
+    column name (e.g. result['total_analogy']) returns a Pandas series.
+
+    Parameters
+    ----------
+    total_analogy : array
+        Total analogy values, with shape (N,).
+    weighted_analogies : array
+        Weighted single-criterion analogy values, with shape (5, N) and rows
+        in the order of CRITERIA.
+    volcano_idx : int, optional
+        Index of the target volcano.
+    weights : array, optional
+        Weighting scheme used, in the order of CRITERIA.
+    rows : array of int, optional
+        Indices of the volcanoes selected (e.g. the top analogues), in the
+        order in which they are presented. By default, all volcanoes.
+    """
+
+    def __init__(self, total_analogy, weighted_analogies, volcano_idx=None,
+                 weights=None, rows=None):
+        self.total_analogy = total_analogy
+        self.weighted_analogies = weighted_analogies
+        self.volcano_idx = volcano_idx
+        self.weights = weights
+        self.rows = None if rows is None else np.asarray(rows, dtype=int)
+
+    @property
+    def columns(self):
+        return list(RESULT_NAMES.columns) + \
+            ['total_analogy'] + [ANALOGY_COLUMNS[c] for c in CRITERIA]
+
+    def select(self, rows):
+        """
+        Returns a result restricted to the given volcano indices (which
+        refer to all volcanoes, not to the rows already selected).
+        """
+        return type(self)(self.total_analogy, self.weighted_analogies,
+                          self.volcano_idx, self.weights, rows)
+
+    def to_frame(self, rows=None):
+        """
+        Builds a Pandas dataframe with the selected rows, or with the given
+        volcano indices, indexed by volcano index.
+        """
+        if rows is None:
+            rows = self.rows
+        if rows is None:
+            frame = RESULT_NAMES.copy()
+            values = slice(None)
+        else:
+            rows = np.asarray(rows, dtype=int)
+            frame = RESULT_NAMES.iloc[rows].copy()
+            values = rows
+        frame['total_analogy'] = self.total_analogy[values]
+        for criterion, weighted_analogy in zip(CRITERIA,
+                                               self.weighted_analogies):
+            frame[ANALOGY_COLUMNS[criterion]] = weighted_analogy[values]
+
+        return frame
+
+    def __getitem__(self, column):
+        rows = slice(None) if self.rows is None else self.rows
+        if column in RESULT_NAMES.columns:
+            return RESULT_NAMES[column].iloc[rows]
+        if column == 'total_analogy':
+            values = self.total_analogy
+        else:
+            criterion = {name: criterion for criterion, name
+                         in ANALOGY_COLUMNS.items()}[column]
+            values = self.weighted_analogies[CRITERIA.index(criterion)]
+        return pd.Series(values[rows], name=column,
+                         index=RESULT_NAMES.index[rows])
+
+    def __len__(self):
+        return len(self.total_analogy) if self.rows is None \
+            else len(self.rows)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(volcano_idx={self.volcano_idx}, "
+                f"rows={len(self)})")
+
+
+def _select_result_rows(volcans_result, rows):
+    """
+    Returns the given rows (by volcano index) of a PyVOLCANS result, given
+    as a Pandas dataframe or as an AnalogyResult, as a Pandas dataframe.
+    """
+    if isinstance(volcans_result, AnalogyResult):
+        return volcans_result.to_frame(rows)
+    return volcans_result.iloc[rows]
+
+
+def _check_total_analogy(volcans_result, rows, expected):
+    """
+    Raises a PyvolcansError if the total analogy values of a PyVOLCANS
+    result for the given rows (by volcano index) differ from the expected
+    values, i.e. if the result was not calculated with the weighting scheme
+    that the expected values were calculated with. Rows that are not in the
+    result are not checked.
+    """
+    values = volcans_result['total_analogy'].reindex(rows).to_numpy()
+    checked = ~np.isnan(values)
+    # NB. Tables of top analogues store the values as float32
+    if not np.allclose(values[checked], np.asarray(expected)[checked],
+                       rtol=0, atol=1e-6):
+        msg = ("The total analogy values in volcans_result do not match "
+               "the weighting scheme given. Please calculate the result "
+               "with the same weights.")
+        raise PyvolcansError(msg)
+
+
+def weights_to_array(weights):
+    """
+    Converts a weighting scheme into an array of weights in the order of
+    CRITERIA (tectonic setting, geochemistry, morphology, eruption size and
+    eruption style).
+
+    Parameters
+    ----------
+    weights : dict or array-like
+        Weights keyed by volcanological criterion, or already given in the
+        order of CRITERIA (the last dimension must have length 5).
+
+    Returns
+    -------
+    weights_array : array
+        Weights as floats, with shape (5,) (or (..., 5) for several
+        weighting schemes).
+    """
+    if isinstance(weights, dict):
+        return np.array([weights[criterion] for criterion in CRITERIA],
+                        dtype=float)
+
+    weights_array = np.asarray(weights, dtype=float)
+    if weights_array.ndim == 0 or weights_array.shape[-1] != len(CRITERIA):
+        msg = (f"Weights must be given for the {len(CRITERIA)} "
+               f"volcanological criteria ({', '.join(CRITERIA)})")
+        raise PyvolcansError(msg)
+
+    return weights_array
+
+
+def get_analogy_rows(volcano_indices, weights, analogies=ANALOGY_MATRIX):
+    """
+    Stacks the (unweighted) single-criterion analogy values of one or more
+    target volcanoes, in the order of CRITERIA. The rows of an AnalogyStack
+    are read with a single gather, as are those of the default analogy
+    matrices when they are read from the data bundle (see MatBackend);
+    otherwise the row(s) of each criterion are read in turn. Criteria with
+    zero weight are skipped (their rows are left as zeros), so that their
+    analogy values are never read.
+
+    Parameters
+    ----------
+    volcano_indices : int or array of int
+        Indices of the target volcanoes.
+    weights : array
+        Weights in the order of CRITERIA (see weights_to_array), with shape
+        (5,) or (W, 5) for W weighting schemes.
+    analogies: dict (fixed keyword argument)
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore.
+
+    Returns
+    -------
+    analogy_rows : array
+        Single-criterion analogy values, with shape (5, N) for a single
+        volcano index or (T, 5, N) for T indices.
+    """
+    used_criteria = np.reshape(weights, (-1, len(CRITERIA))).any(axis=0)
+    if _uses_bundle_data(analogies):
+        analogies = load_analogy_stack()
+    if isinstance(analogies, SharedAnalogyStore):
+        analogies = analogies.analogies
+    if isinstance(analogies, AnalogyStack):
+        return analogies.rows(volcano_indices, used_criteria)
+
+    volcano_indices = np.asarray(volcano_indices)
+    analogy_rows = np.zeros(volcano_indices.shape +
+                            (len(CRITERIA), len(VOLCANO_NAMES)))
+    for i, criterion in enumerate(CRITERIA):
+        if used_criteria[i]:
+            analogy_rows[..., i, :] = analogies[criterion][volcano_indices]
+
+    return analogy_rows
+
+
+def calculate_weighted_analogy_rows(my_volcano, weights,
+                                    analogies=ANALOGY_MATRIX):
+    """
+    Calculates the weighted single-criterion and total analogy values between
+    the target volcano and any other volcano in the GVP database, using only
+    the row of the target volcano in each single-criterion analogy matrix.
+    No N x N matrices are built, so this is the engine used by
+    calculate_weighted_analogy_matrix.
+
+    Parameters
+    ----------
+    my_volcano : str or int
+        Target volcano selected by the user, as volcano name or volcano number
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    analogies: dict (fixed keyword argument)
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore (see calculate_weighted_analogy_matrix).
+
+    Returns
+    -------
+    weighted_analogies : array
+        Weighted single-criterion analogy values, with shape (5, N) and rows
+        in the order of CRITERIA (tectonic setting, geochemistry, morphology,
+        eruption size and eruption style).
+    weighted_total_analogy : array
+        Total analogy values, with shape (N,).
+    """
+    weights_array = weights_to_array(weights)
 
     # get the index for my_volcano
     volcano_idx = convert_to_idx(my_volcano)
 
-    # check for volcanological criteria without data for the target volcano
-    my_volcano_data_dictionary = {}
-    # NB. If the single-criterion analogy of the target volcano with itself is
-    # equal to zero, then there is no data available for that particular
-    # volcanological criterion
-    for criterion in analogies.keys():
-        single_analogies = analogies[criterion]
-        my_volcano_single_analogies = single_analogies[volcano_idx]
-        # to make tests pass (my_volcano_single_analogies becomes an int32
-        # when implementing some of the tests)
-        if isinstance(my_volcano_single_analogies, np.ndarray):
-            my_volcano_data_dictionary[criterion] = \
-                my_volcano_single_analogies[volcano_idx]
+    analogy_rows = get_analogy_rows(volcano_idx, weights_array, analogies)
 
     # check for volcanological criteria without data for target volcano
+    # NB. If the single-criterion analogy of the target volcano with itself is
+    # equal to zero, then there is no data available for that particular
+    # volcanological criterion.
+    my_volcano_data_dictionary = dict(zip(CRITERIA,
+                                          analogy_rows[:, volcano_idx]))
     warn_on_criteria_without_data(my_volcano_data_dictionary,
                                   my_volcano,
-                                  weights)
+                                  dict(zip(CRITERIA, weights_array)))
 
-    # calculate single-criterion analogy matrices for specific weighting scheme
-    weighted_tectonic_analogy = \
-        weights['tectonic_setting'] * analogies['tectonic_setting']
+    # calculate single-criterion and total analogies for specific weighting
+    # scheme, the latter as the contraction of the rows with the weights
+    weighted_analogies = weights_array[:, np.newaxis] * analogy_rows
+    weighted_total_analogy = np.einsum('c,cn->n', weights_array,
+                                       analogy_rows)
 
-    weighted_geochemistry_analogy = \
-        weights['geochemistry'] * analogies['geochemistry']
+    return weighted_analogies, weighted_total_analogy
 
-    weighted_morphology_analogy = \
-        weights['morphology'] * analogies['morphology']
 
-    weighted_eruption_size_analogy = \
-        weights['eruption_size'] * analogies['eruption_size']
+@timed
+def calculate_weighted_analogy_batch(targets, weights, analogies=None,
+                                     tidy=False):
+    """
+    Calculates the weighted single-criterion and total analogy values between
+    each of many target volcanoes and any other volcano in the GVP database,
+    using one weighting scheme. All targets are resolved first, in one pass
+    (see resolve_targets), and their rows are read with one gather and
+    combined with one contraction, rather than by calling
+    calculate_weighted_analogy_matrix for each target.
 
-    weighted_eruption_style_analogy = \
-        weights['eruption_style'] * analogies['eruption_style']
+    Parameters
+    ----------
+    targets : list of str or int
+        Target volcanoes, as volcano names or volcano numbers
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    analogies : dict, optional
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore. By default the analogy matrices of the data
+        backend are used, stacked if the backend provides them so.
+    tidy : bool, optional
+        If True, return the result as a long-format Pandas dataframe instead
+        of arrays (see Returns).
 
-    # calculate total analogy matrix for specific weighting scheme
-    weighted_total_analogy_matrix = weighted_tectonic_analogy + \
-        weighted_geochemistry_analogy + weighted_morphology_analogy + \
-        weighted_eruption_size_analogy + weighted_eruption_style_analogy
+    Returns
+    -------
+    weighted_total_analogy : array
+        Total analogy values, with shape (T, N) for T target volcanoes.
+    weighted_analogies : array
+        Weighted single-criterion analogy values, with shape (T, 5, N) and
+        criteria in the order of CRITERIA.
 
-    # arrange final result
-    volcans_result = VOLCANO_NAMES.copy()
+    If tidy is True, a single Pandas dataframe is returned instead, with one
+    row per target volcano and volcano in the GVP database (T * N rows), the
+    columns 'target_name' and 'target_smithsonian_id', followed by the
+    columns of the result of calculate_weighted_analogy_matrix.
+
+    Raises
+    ------
+    PyvolcansError
+        Listing all the targets that could not be resolved (see
+        resolve_targets).
+    """
+    volcano_indices = resolve_targets(targets)
+    weighted_total_analogy, weighted_analogies = \
+        _calculate_weighted_analogy_batch(targets, volcano_indices, weights,
+                                          analogies)
+
+    if not tidy:
+        return weighted_total_analogy, weighted_analogies
+
+    n_volcanoes = len(VOLCANO_NAMES)
+    volcans_result = pd.concat([VOLCANO_NAMES] * len(volcano_indices),
+                               ignore_index=True)
     volcans_result.columns = ['name', 'country', 'smithsonian_id']
-    volcans_result['total_analogy'] = \
-        weighted_total_analogy_matrix[volcano_idx, ]
-    volcans_result['ATs'] = \
-        weighted_tectonic_analogy[volcano_idx, ]
-    volcans_result['AG'] = \
-        weighted_geochemistry_analogy[volcano_idx, ]
-    volcans_result['AM'] = \
-        weighted_morphology_analogy[volcano_idx, ]
-    volcans_result['ASz'] = \
-        weighted_eruption_size_analogy[volcano_idx, ]
-    volcans_result['ASt'] = \
-        weighted_eruption_style_analogy[volcano_idx, ]
+    volcans_result.insert(
+        0, 'target_name',
+        np.repeat(VOLCANO_NAMES[0].values[volcano_indices], n_volcanoes))
+    volcans_result.insert(
+        1, 'target_smithsonian_id',
+        np.repeat(VOLCANO_NAMES[2].values[volcano_indices], n_volcanoes))
+    volcans_result['total_analogy'] = weighted_total_analogy.ravel()
+    for i, criterion in enumerate(CRITERIA):
+        volcans_result[ANALOGY_COLUMNS[criterion]] = \
+            weighted_analogies[:, i].ravel()
 
     return volcans_result
 
 
+def _calculate_weighted_analogy_batch(targets, volcano_indices, weights,
+                                      analogies=None):
+    """
+    Calculates the total and weighted single-criterion analogy rows of
+    target volcanoes already resolved to volcano_indices (see
+    calculate_weighted_analogy_batch).
+    """
+    if analogies is None:
+        analogies = get_backend().read_analogy_stack()
+        if analogies is None:
+            analogies = ANALOGY_MATRIX
+
+    weights_array = weights_to_array(weights)
+    analogy_rows = get_analogy_rows(volcano_indices, weights_array, analogies)
+
+    # check for volcanological criteria without data for the targets
+    weights_dict = dict(zip(CRITERIA, weights_array))
+    self_analogies = analogy_rows[np.arange(len(volcano_indices)), :,
+                                  volcano_indices]
+    for target, target_self_analogies in zip(targets, self_analogies):
+        warn_on_criteria_without_data(dict(zip(CRITERIA,
+                                               target_self_analogies)),
+                                      target, weights_dict)
+
+    weighted_analogies = weights_array[:, np.newaxis] * analogy_rows
+    weighted_total_analogy = np.einsum('c,tcn->tn', weights_array,
+                                       analogy_rows)
+
+    return weighted_total_analogy, weighted_analogies
+
+
+@timed
+def calculate_weighted_analogy_schemes(my_volcano, weights,
+                                       analogies=ANALOGY_MATRIX):
+    """
+    Calculates the total analogy values between the target volcano and any
+    other volcano in the GVP database for many weighting schemes at once,
+    as one matrix product of the weighting schemes and the single-criterion
+    analogy rows of the target volcano.
+
+    Parameters
+    ----------
+    my_volcano : str or int
+        Target volcano selected by the user, as volcano name or volcano number
+    weights : array-like
+        Weighting schemes, with shape (W, 5) and weights in the order of
+        CRITERIA. Each scheme is checked with validate_weights_array.
+    analogies: dict (fixed keyword argument)
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore (see calculate_weighted_analogy_matrix).
+
+    Returns
+    -------
+    weighted_total_analogy : array
+        Total analogy values, with shape (W, N): row w holds the values
+        obtained with weighting scheme w.
+
+    Raises
+    ------
+    PyvolcansError
+        If any of the weighting schemes is not valid.
+    """
+    weights_array = validate_weights_array(weights)
+    volcano_idx = convert_to_idx(my_volcano)
+
+    analogy_rows = get_analogy_rows(volcano_idx, weights_array, analogies)
+
+    # check for volcanological criteria without data for the target volcano,
+    # among those weighted in any of the schemes
+    warn_on_criteria_without_data(
+        dict(zip(CRITERIA, analogy_rows[:, volcano_idx])), my_volcano,
+        dict(zip(CRITERIA, weights_array.max(axis=0))))
+
+    return weights_array @ analogy_rows
+
+
+def get_top_analogue_indices(total_analogy, volcano_idx, count=10):
+    """
+    Finds the indices of the top analogue volcanoes in one or many rows of
+    total analogy values, with a partial sort of each row (the whole row is
+    not sorted). The target volcano is excluded from its own analogues.
+
+    Volcanoes are ordered from highest to lowest total analogy, and volcanoes
+    with the same total analogy are ordered by index (i.e. by their position
+    in the GVP database), also when deciding which of them make it into the
+    top count.
+
+    Parameters
+    ----------
+    total_analogy : array
+        Total analogy values, with shape (N,) or (R, N) for R rows (e.g. one
+        per weighting scheme or per target volcano).
+    volcano_idx : int or array of int
+        Index of the target volcano, or one index per row.
+    count : int, optional
+        Number of top analogue volcanoes to find. Default = 10
+
+    Returns
+    -------
+    top_indices : array
+        Indices of the top analogue volcanoes, with shape (count,) or
+        (R, count).
+    """
+    total_analogy = np.asarray(total_analogy, dtype=float)
+    single_row = total_analogy.ndim == 1
+    total_analogy = np.array(np.atleast_2d(total_analogy))
+    n_rows, n_volcanoes = total_analogy.shape
+    count = min(count, n_volcanoes - 1)
+    if count <= 0:
+        top_indices = np.empty((n_rows, 0), dtype=int)
+        return top_indices[0] if single_row else top_indices
+
+    # exclude the target volcano(es)
+    row_numbers = np.arange(n_rows)
+    total_analogy[row_numbers, np.broadcast_to(volcano_idx, n_rows)] = -np.inf
+
+    # value of the count-th highest analogy of each row
+    threshold = -np.partition(-total_analogy, count - 1,
+                              axis=1)[:, count - 1:count]
+    above = total_analogy > threshold
+    tied = total_analogy == threshold
+    # keep the tied volcanoes with the lowest indices
+    n_tied_needed = count - above.sum(axis=1, keepdims=True)
+    selected = above | (tied & (np.cumsum(tied, axis=1) <= n_tied_needed))
+    top_indices = np.nonzero(selected)[1].reshape(n_rows, count)
+
+    # sort the selection (indices are already ascending, so a stable sort
+    # keeps ties in index order)
+    order = np.argsort(-np.take_along_axis(total_analogy, top_indices, axis=1),
+                       axis=1, kind='stable')
+    top_indices = np.take_along_axis(top_indices, order, axis=1)
+
+    return top_indices[0] if single_row else top_indices
+
+
+@timed
+def export_total_analogy_matrix(filename, weights, block_size=128,
+                                analogies=None):
+    """
+    Calculates the total analogy values between every pair of volcanoes in
+    the GVP database (the full N x N matrix) for one weighting scheme, and
+    writes them to a NumPy (.npy) or HDF5 (.h5, .hdf5) file.
+
+    The matrix is calculated and written in blocks of rows (i.e. of target
+    volcanoes), so the memory used is bounded by the block size rather than
+    by the size of the whole matrix. Row i of the matrix is equal to the
+    total analogy values given by calculate_weighted_analogy_matrix for
+    volcano index i.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Output file, whose suffix selects the format. HDF5 files require
+        h5py, and store the matrix as the dataset 'total_analogy', chunked by
+        row, with the weights as attributes.
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    block_size : int, optional
+        Number of rows calculated at a time. Default = 128
+    analogies : dict, optional
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore (see calculate_weighted_analogy_batch).
+
+    Raises
+    ------
+    PyvolcansError
+        If the weighting scheme is not valid, the block size is not positive
+        or the file format is not supported.
+    """
+    weights_array = validate_weights_array(weights)
+    if len(weights_array) != 1:
+        raise PyvolcansError("A single weighting scheme must be given")
+    weights_array = weights_array[0]
+    if block_size < 1:
+        raise PyvolcansError(f"Block size ({block_size}) must be positive")
+
+    if analogies is None:
+        analogies = get_backend().read_analogy_stack()
+        if analogies is None:
+            analogies = ANALOGY_MATRIX
+
+    filename = Path(filename)
+    n_volcanoes = len(VOLCANO_NAMES)
+    shape = (n_volcanoes, n_volcanoes)
+    if filename.suffix == '.npy':
+        h5_file = None
+        total_analogy = np.lib.format.open_memmap(filename, mode='w+',
+                                                  dtype=np.float64,
+                                                  shape=shape)
+    elif filename.suffix in ('.h5', '.hdf5'):
+        import h5py
+
+        h5_file = h5py.File(filename, 'w')
+        total_analogy = h5_file.create_dataset('total_analogy', shape=shape,
+                                               dtype=np.float64,
+                                               chunks=(1, n_volcanoes))
+        total_analogy.attrs['criteria'] = list(CRITERIA)
+        total_analogy.attrs['weights'] = weights_array
+    else:
+        msg = (f"Unsupported file format ({filename.suffix}): please use "
+               ".npy, .h5 or .hdf5")
+        raise PyvolcansError(msg)
+
+    try:
+        for start in range(0, n_volcanoes, block_size):
+            volcano_indices = np.arange(start,
+                                        min(start + block_size, n_volcanoes))
+            analogy_rows = get_analogy_rows(volcano_indices, weights_array,
+                                            analogies)
+            total_analogy[start:start + len(volcano_indices)] = \
+                np.einsum('c,tcn->tn', weights_array, analogy_rows)
+    finally:
+        if h5_file is None:
+            total_analogy.flush()
+            del total_analogy
+        else:
+            h5_file.close()
+
+
+@timed
+def build_top_analogue_table(weights, count=TOP_ANALOGUES_COUNT,
+                             block_size=128, workers=None, analogies=None):
+    """
+    Finds the top analogue volcanoes of every volcano in the GVP database for
+    one weighting scheme. The total analogy values are calculated in blocks
+    of rows, processed in parallel threads, and each block is reduced to its
+    top analogues with a partial sort (see get_top_analogue_indices), so the
+    full N x N matrix is never held in memory.
+
+    Parameters
+    ----------
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    count : int, optional
+        Number of top analogues kept for each volcano. Default = 100
+    block_size : int, optional
+        Number of rows calculated at a time by each thread. Default = 128
+    workers : int, optional
+        Number of threads (by default, as chosen by ThreadPoolExecutor).
+    analogies : dict, optional
+        Single-criterion analogy matrices, an AnalogyStack or a
+        SharedAnalogyStore (see calculate_weighted_analogy_batch).
+
+    Returns
+    -------
+    top_indices : array
+        Indices of the top analogues of each volcano, with shape (N, count)
+        and type int16.
+    top_values : array
+        Their total analogy values, with shape (N, count) and type float32.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    weights_array = validate_weights_array(weights)
+    if len(weights_array) != 1:
+        raise PyvolcansError("A single weighting scheme must be given")
+    weights_array = weights_array[0]
+
+    if analogies is None:
+        analogies = get_backend().read_analogy_stack()
+        if analogies is None:
+            analogies = ANALOGY_MATRIX
+
+    n_volcanoes = len(VOLCANO_NAMES)
+    count = min(count, n_volcanoes - 1)
+    top_indices = np.empty((n_volcanoes, count), dtype=np.int16)
+    top_values = np.empty((n_volcanoes, count), dtype=np.float32)
+
+    def process_block(start):
+        volcano_indices = np.arange(start, min(start + block_size,
+                                               n_volcanoes))
+        analogy_rows = get_analogy_rows(volcano_indices, weights_array,
+                                        analogies)
+        total_analogy = np.einsum('c,tcn->tn', weights_array, analogy_rows)
+        block_indices = get_top_analogue_indices(total_analogy,
+                                                 volcano_indices, count)
+        top_indices[volcano_indices] = block_indices
+        top_values[volcano_indices] = np.take_along_axis(
+            total_analogy, block_indices, axis=1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # NB. list() re-raises any exception from the threads
+        list(executor.map(process_block, range(0, n_volcanoes, block_size)))
+
+    return top_indices, top_values
+
+
+def get_top_analogue_table(weights, build=False, count=TOP_ANALOGUES_COUNT):
+    """
+    Returns the table of top analogues of every volcano for the weighting
+    scheme (a TopAnalogueTable), if one was shipped with PyVOLCANS (as for
+    the equal-weight scheme) or saved in the cache directory. Tables hold
+    the top analogues from the data bundle, in the storage type set by the
+    PYVOLCANS_ANALOGY_STORAGE environment variable, so no table is returned
+    if another data backend is in use (see set_backend).
+
+    Parameters
+    ----------
+    weights : dict or array-like
+        Set of weights (weighting scheme), as a dictionary or as an array in
+        the order of CRITERIA
+    build : bool, optional
+        If True and there is no table for the weighting scheme with at least
+        count analogues per volcano, build one (see build_top_analogue_table)
+        and save it in the cache directory.
+    count : int, optional
+        Number of top analogues per volcano of a table built (at most the
+        number of volcanoes minus one). Default = 100
+
+    Returns
+    -------
+    table : TopAnalogueTable or None
+        None if there is no table and build is False, or if the data backend
+        is not a MatBackend.
+    """
+    if not isinstance(get_backend(), MatBackend):
+        return None
+
+    weights_array = weights_to_array(weights)
+    storage = get_analogy_storage()
+    # NB. Only tables with enough analogues are looked for if building
+    count = min(count, len(VOLCANO_NAMES) - 1)
+    table = find_top_analogue_table(weights_array, storage,
+                                    count if build else None)
+    if table is None and build:
+        top_indices, top_values = build_top_analogue_table(
+            weights_array, count, analogies=load_analogy_stack(storage))
+        filename = get_top_analogues_path(weights_array, storage=storage)
+        TopAnalogueTable.write(filename, top_indices, top_values,
+                               weights_array, get_source_key(), storage)
+        table = find_top_analogue_table(weights_array, storage, count)
+
+    return table
+
+
+class AnalogyCache:
+    """
+    Bounded cache of the total analogy values of target volcanoes, keyed on
+    the volcano index and the weighting scheme (with weights rounded to
+    1e-9). Each entry holds the total analogy row of the target volcano and
+    the order of the volcanoes from highest to lowest total analogy (ties in
+    index order), so repeated queries for the same target and weighting
+    scheme (e.g. top analogues for different counts, or percentiles of
+    several a priori analogues) do not recompute or re-sort them. When the
+    cache is full, the least recently used entry is discarded.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries. Default = 128
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups found, or not found, in the cache.
+    """
+
+    def __init__(self, maxsize=128):
+        self._entries = OrderedDict()
+        self._maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        """Maximum number of entries (can be changed at any time)."""
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize):
+        self._maxsize = maxsize
+        self._trim()
+
+    def _trim(self):
+        while len(self._entries) > max(self._maxsize, 0):
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _key(volcano_idx, weights_array):
+        return (int(volcano_idx),
+                tuple((np.round(weights_array, 9) + 0.).tolist()))
+
+    def _store(self, key, total_analogy):
+        order = np.argsort(-total_analogy, kind='stable')
+        total_analogy.flags.writeable = False
+        order.flags.writeable = False
+        entry = {'total_analogy': total_analogy, 'order': order,
+                 'percentiles': None}
+        self._entries[key] = entry
+        self._trim()
+        return entry
+
+    def _lookup(self, volcano_idx, weights):
+        weights_array = weights_to_array(weights)
+        key = self._key(volcano_idx, weights_array)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        analogy_rows = get_analogy_rows(volcano_idx, weights_array)
+        total_analogy = np.einsum('c,cn->n', weights_array, analogy_rows)
+        return self._store(key, total_analogy)
+
+    def put(self, volcano_idx, weights, total_analogy):
+        """
+        Stores the total analogy row (N,) of the target volcano, calculated
+        with the weighting scheme and the default analogy matrices (e.g. by
+        calculate_weighted_analogy_matrix), unless it is already cached.
+        This is not counted as a hit or a miss.
+        """
+        key = self._key(volcano_idx, weights_to_array(weights))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            self._store(key, np.array(total_analogy, dtype=np.float64))
+
+    def get(self, volcano_idx, weights):
+        """
+        Returns the total analogy row (N,) of the target volcano and its
+        order from highest to lowest total analogy, calculating them with the
+        default analogy matrices if they are not cached. Both arrays are
+        read-only.
+        """
+        entry = self._lookup(volcano_idx, weights)
+        return entry['total_analogy'], entry['order']
+
+    def get_percentiles(self, volcano_idx, weights):
+        """
+        Returns the total analogy row of the target volcano and its
+        percentiles from 0 to 100 (see get_analogy_percentile), which are
+        calculated from the sorted values only once per entry.
+        """
+        entry = self._lookup(volcano_idx, weights)
+        if entry['percentiles'] is None:
+            sorted_analogy_values = \
+                entry['total_analogy'][entry['order'][::-1]]
+            entry['percentiles'] = np.percentile(sorted_analogy_values,
+                                                 np.linspace(0, 100, 101),
+                                                 interpolation='midpoint')
+        return entry['total_analogy'], entry['percentiles']
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Returns the hits, misses, maximum size and current size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'maxsize': self._maxsize, 'currsize': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.info()})"
+
+
+# cache of recent queries, used by get_analogies and get_analogy_percentile
+ANALOGY_CACHE = AnalogyCache()
+
+
 def get_volcano_source_data(my_volcano, data = VOLCANO_DATA):
     """
     Extracts the 'ID profile' (i.e. available data for each volcanological
@@ -492,6 +1675,8 @@ def get_volcano_source_data(my_volcano, data = VOLCANO_DATA):
     data : dict (fixed keyword argument)
         Dictionary containing the volcanological data available in GVP v4.6.7
         for all Holocene volcanoes listed in that version of the database.
+        A SharedAnalogyStore can also be given, to use the volcano data
+        published in shared memory.
     Returns
     -------
     result : dict
@@ -499,6 +1684,9 @@ def get_volcano_source_data(my_volcano, data = VOLCANO_DATA):
         criteria available for my_volcano (i.e. its ID profile)
     """
 
+    if isinstance(data, SharedAnalogyStore):
+        data = data.data
+
     # get the index for my_volcano
     volcano_idx = convert_to_idx(my_volcano)
 
@@ -600,7 +1788,8 @@ def output_many_volcanoes_data(top_analogues_list, filename):
         json.dump(tmp_result_list, outfile, indent=2, sort_keys=False)
 
 
-def get_analogies(my_volcano, volcans_result, count=10):
+@timed
+def get_analogies(my_volcano, volcans_result, count=10, weights=None):
     """
     Derives a filtered Pandas dataframe, which contains the total and single-
     criterion analogy values between the target volcano and a given number of
@@ -610,7 +1799,7 @@ def get_analogies(my_volcano, volcans_result, count=10):
     ----------
     my_volcano : str or int
         Target volcano selected by the user, as volcano name or volcano number
-    volcans_result : Pandas dataframe
+    volcans_result : Pandas dataframe or AnalogyResult
         Total and single-criterion analogy values between the target volcano
         and any volcano listed in the GVP database (v. 4.6.7)
 
@@ -620,13 +1809,24 @@ def get_analogies(my_volcano, volcans_result, count=10):
         an entirely different set of total analogy values.
     count: int, optional
         Number of top analogue volcanoes to derive. Default = 10
+    weights: dict, optional
+        Weighting scheme used to calculate volcans_result (by default, that
+        of an AnalogyResult calculated with the default analogy matrices).
+        If given, the top analogues are read from a table of top analogues
+        for it, if one exists (see get_top_analogue_table), or else from the
+        sorted total analogy values in ANALOGY_CACHE, instead of being
+        searched for in volcans_result. A PyvolcansError is raised if the
+        total analogy values of the top analogues in volcans_result do not
+        match those calculated with the weights.
 
     Returns
     -------
     filtered_result: Pandas dataframe
         Sub-set of results from the Pandas dataframe volcans_result,
         thus only including the data for the top analogue volcanoes
-        to the target volcano.
+        to the target volcano, from highest to lowest total analogy.
+        Volcanoes with the same total analogy are ordered by their position
+        in the GVP database (see get_top_analogue_indices).
     volcano_name: str
         Target volcano's name in the GVP database (www.volcano.si.edu).
         NB. Variable required to derive some of the outputs of PyVOLCANS
@@ -635,23 +1835,117 @@ def get_analogies(my_volcano, volcans_result, count=10):
 
     # get the index for my_volcano
     volcano_idx = convert_to_idx(my_volcano)
-    # get the row corresponding to the target volcano ('my_volcano')
-    my_volcano_analogies = volcans_result['total_analogy']
-    # get the indices corresponding to the highest values of analogy
-    # in descending order (highest analogy first)
-    # NB. count+1 is used as the top analogue is likely
-    #     to be the target volcano itself
-    top_idx = my_volcano_analogies.argsort().tail(count+1)[::-1]
-    result = volcans_result.iloc[top_idx]
-    # 'filter out' the target volcano from the final result
-    my_volcano_boolean_indexes = result.index.isin([volcano_idx])
-    filtered_result = result[~my_volcano_boolean_indexes]
+    if weights is None and isinstance(volcans_result, AnalogyResult):
+        weights = volcans_result.weights
+    # read the top analogues from a table, if there is one for the weights
+    # and the data that the analogy values were calculated from
+    table = None
+    if weights is not None and isinstance(get_backend(), MatBackend):
+        table = get_top_analogue_table(weights)
+    if table is not None and count <= table.count:
+        top_idx, top_values = table.top(volcano_idx, count)
+    elif weights is not None:
+        total_analogy, order = ANALOGY_CACHE.get(volcano_idx, weights)
+        top_idx = order[:count + 1]
+        top_idx = top_idx[top_idx != volcano_idx][:count]
+        top_values = total_analogy[top_idx]
+    else:
+        # get the row corresponding to the target volcano ('my_volcano')
+        my_volcano_analogies = volcans_result['total_analogy'].to_numpy()
+        # get the indices corresponding to the highest values of analogy
+        # in descending order (highest analogy first), with a partial sort
+        # NB. The target volcano is excluded before the selection
+        top_idx = get_top_analogue_indices(my_volcano_analogies, volcano_idx,
+                                           count)
+    filtered_result = _select_result_rows(volcans_result, top_idx)
+    if weights is not None:
+        _check_total_analogy(filtered_result, top_idx, top_values)
     # obtain volcano name from volcano_idx as my_volcano could be an int
     volcano_name = get_volcano_name_from_idx(volcano_idx)
 
     return filtered_result, volcano_name
 
 
+@timed
+def get_analogues_above(my_volcano, weights, threshold,
+                        analogies=ANALOGY_MATRIX):
+    """
+    Derives a Pandas dataframe with all the volcanoes whose total analogy
+    with the target volcano is greater than or equal to a threshold, as an
+    alternative to selecting a fixed number of top analogues.
+
+    For weighting schemes that use a single volcanological criterion (e.g.
+    eruption style only), the volcanoes are found by a binary search in the
+    precomputed order of that criterion's analogy values (see
+    get_analogy_order_index), without calculating the whole total analogy
+    row. Otherwise, the row is calculated and scanned.
+
+    Parameters
+    ----------
+    my_volcano : str or int
+        Target volcano selected by the user, as volcano name or volcano number
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    threshold : float
+        Minimum value of total analogy (between 0 and 1).
+    analogies: dict (fixed keyword argument)
+        Single-criterion analogy matrices (see
+        calculate_weighted_analogy_matrix).
+
+    Returns
+    -------
+    filtered_result: Pandas dataframe
+        Total and single-criterion analogy values between the target volcano
+        and the volcanoes above the threshold (the target volcano itself is
+        excluded), with the same columns as the result of
+        calculate_weighted_analogy_matrix, from highest to lowest total
+        analogy. Volcanoes with the same total analogy are ordered by their
+        position in the GVP database.
+
+    Raises
+    ------
+    PyvolcansError
+        If the weighting scheme is not valid (see validate_weights_array).
+    """
+    weights_array = validate_weights_array(weights)
+    if len(weights_array) != 1:
+        raise PyvolcansError("A single weighting scheme must be given")
+    weights_array = weights_array[0]
+    volcano_idx = convert_to_idx(my_volcano)
+    used_criteria = np.flatnonzero(weights_array)
+
+    if len(used_criteria) == 1 and _uses_bundle_data(analogies):
+        criterion = CRITERIA[used_criteria[0]]
+        weight = weights_array[used_criteria[0]]
+        order_index = get_analogy_order_index()
+        warn_on_criteria_without_data(
+            {criterion: order_index.analogies[criterion].values(volcano_idx,
+                                                                volcano_idx)},
+            my_volcano, dict(zip(CRITERIA, weights_array)))
+        top_idx, top_values = order_index.above(criterion, volcano_idx,
+                                                threshold, weight)
+
+        # NB. The criteria with zero weight have zero weighted analogy
+        weighted_analogies = np.zeros((len(CRITERIA), len(VOLCANO_NAMES)))
+        weighted_analogies[used_criteria[0], top_idx] = top_values
+        total_analogy = np.zeros(len(VOLCANO_NAMES))
+        total_analogy[top_idx] = top_values
+        volcans_result = AnalogyResult(total_analogy, weighted_analogies,
+                                       volcano_idx, weights_array)
+    else:
+        volcans_result = calculate_weighted_analogy_matrix(
+            my_volcano, weights_array, analogies, as_frame=False)
+        total_analogy = volcans_result.total_analogy
+        top_idx = np.flatnonzero(total_analogy >= threshold)
+        top_idx = top_idx[np.argsort(-total_analogy[top_idx], kind='stable')]
+
+    top_idx = top_idx[top_idx != volcano_idx]
+    filtered_result = volcans_result.to_frame(top_idx)
+
+    return filtered_result
+
+
 def warn_on_perfect_analogues(result):
     """
     Assesses whether all the calculated top analogue volcanoes share the same
@@ -694,11 +1988,10 @@ def warn_on_criteria_without_data(my_volcano_data, my_volcano_name, weights):
     weights : dict
         Set of weights (weighting scheme) selected by the user to run PyVOLCANS
     """
-    my_flag_list = ['-Ts', '-G', '-M', '-Sz', '-St']
     my_list_keys = list()
-    for (key, value), flag in zip(my_volcano_data.items(), my_flag_list):
+    for key, value in my_volcano_data.items():
         if value == 0 and weights[key] > 0:
-            my_list_keys.append(f'{key} ({flag})')
+            my_list_keys.append(f'{key} ({CRITERIA_FLAGS[key]})')
 
     # check whether the list is not empty (in other words, there are some
     # volcanological criteria without data)
@@ -733,6 +2026,8 @@ def open_gvp_website(top_analogue_vnum):
         If a web browser to open the URL cannot be identified
     """
 
+    import webbrowser
+
     my_web = f'https://volcano.si.edu/volcano.cfm?vn={top_analogue_vnum}' \
         '&vtab=GeneralInfo'  # Open the General Info tab
     browser_opened = webbrowser.open(my_web)
@@ -742,6 +2037,7 @@ def open_gvp_website(top_analogue_vnum):
         raise PyvolcansError(msg)
 
 
+@timed
 def output_result(verbose, my_volcano, result, to_file=None, filename=None):
     """
     Prepares the final PyVOLCANS results to be written either to the standard
@@ -757,7 +2053,7 @@ def output_result(verbose, my_volcano, result, to_file=None, filename=None):
         values.
     my_volcano : str or int
         Target volcano selected by the user, as volcano name or volcano number
-    result: Pandas dataframe
+    result: Pandas dataframe or AnalogyResult
         Sub-set of results from the Pandas dataframe volcans_result,
         thus only including the data for the top analogue volcanoes
         to the target volcano.
@@ -785,6 +2081,9 @@ def output_result(verbose, my_volcano, result, to_file=None, filename=None):
     else:
         my_columns = ['name', 'country', 'smithsonian_id', 'total_analogy']
 
+    if isinstance(result, AnalogyResult):
+        result = result.to_frame()
+
     if to_file == 'csv':
         result.to_csv(filename, sep=',', float_format='%.5f',
                       header=True, index=False, columns=my_columns)
@@ -794,6 +2093,7 @@ def output_result(verbose, my_volcano, result, to_file=None, filename=None):
     return result
 
 
+@timed
 def match_name(volcano_name):
     """
     Attempts to match the volcano name provided by the user to an existing
@@ -824,23 +2124,38 @@ def match_name(volcano_name):
         using fuzzy_matching(volcano_name), before raising the exception.
     """
 
-    matched_volcanoes = VOLCANO_NAMES.loc[VOLCANO_NAMES[0] == volcano_name]
+    matched_volcanoes = VOLCANO_NAMES.iloc[_match_name_indices(volcano_name)]
+
+    return matched_volcanoes
+
+
+def _match_name_indices(volcano_name):
+    """
+    Returns the index of the volcano with the given name, as a list, via the
+    VOLCANO_IDX_BY_NAME lookup, raising the errors of match_name if the name
+    does not exist or is not unique.
+    """
+    try:
+        matched_idx = VOLCANO_IDX_BY_NAME.get(volcano_name, [])
+    except TypeError:
+        matched_idx = []
     # throw errors either if volcano name does not exist
-    if len(matched_volcanoes) == 0:
+    if len(matched_idx) == 0:
         name_suggestions = fuzzy_matching(volcano_name)
         msg = (f"{volcano_name} not found! Did you mean:\n{name_suggestions}")
         raise PyvolcansError(msg)
 
     # or if there are 2+ identical volcano names
-    if len(matched_volcanoes) > 1:
+    if len(matched_idx) > 1:
         name_suggestions = fuzzy_matching(volcano_name)
         msg = (f"Volcano name {volcano_name} is not unique. "
                f"Please provide smithsonian id instead of name.\n{name_suggestions}")
         raise PyvolcansError(msg)
 
-    return matched_volcanoes
+    return matched_idx
 
 
+@timed
 def plot_bar_apriori_analogues(my_volcano_name, my_volcano_vnum,
                                my_apriori_analogues, volcans_result,
                                criteria_weights_text, save_figure=None):
@@ -859,7 +2174,7 @@ def plot_bar_apriori_analogues(my_volcano_name, my_volcano_vnum,
     my_apriori_analogues:
         List of a priori analogues as introduced by the user via the command
         line.
-    volcans_result : Pandas dataframe
+    volcans_result : Pandas dataframe or AnalogyResult
         Total and single-criterion analogy values between the target volcano
         and any volcano listed in the GVP database (v. 4.6.7).
     criteria_weights_text : str
@@ -877,10 +2192,14 @@ def plot_bar_apriori_analogues(my_volcano_name, my_volcano_vnum,
         purposes on the function.
     """
 
+    import matplotlib.pyplot as plt
+
     # derive the indices for all a priori analogues
     my_apriori_volcano_idx = [convert_to_idx(x) for x in my_apriori_analogues]
 
     # slice volcans_result to derive a data frame with the a priori analogues
+    if isinstance(volcans_result, AnalogyResult):
+        volcans_result = volcans_result.to_frame(my_apriori_volcano_idx)
     all_my_apriori_analogies = \
         volcans_result.loc[my_apriori_volcano_idx,
                            ['name', 'ATs', 'AG', 'AM', 'ASz', 'ASt']]
@@ -910,6 +2229,7 @@ def plot_bar_apriori_analogues(my_volcano_name, my_volcano_vnum,
     return all_my_apriori_analogies
 
 
+@timed
 def plot_bar_better_analogues(my_volcano_name, my_volcano_vnum,
                               better_analogues, criteria_weights_text,
                               save_figure=None):
@@ -948,6 +2268,8 @@ def plot_bar_better_analogues(my_volcano_name, my_volcano_vnum,
         analogues selected, for the specific target volcano. Returned basically
         for testing purposes on the function.
     """
+    import matplotlib.pyplot as plt
+
     # open figure for the 'better analogues' bar plot
     # dict to pandas df based on:
     # https://stackoverflow.com/questions/18837262/convert-python-dict-into-a-dataframe
@@ -973,8 +2295,76 @@ def plot_bar_better_analogues(my_volcano_name, my_volcano_vnum,
     return df_better_analogues
 
 
+PERCENTILE_METHODS = ('midpoint', 'rank')
+
+
+def calculate_analogy_percentiles(total_analogy, apriori_volcano_idx,
+                                  method='midpoint', analogy_percentiles=None):
+    """
+    Calculates the percentiles that the total analogy values of any number
+    of a priori analogues represent within the distribution of total analogy
+    values of the target volcano, in a single vectorised pass.
+
+    Parameters
+    ----------
+    total_analogy : array
+        Total analogy values between the target volcano and all volcanoes in
+        the GVP database, with shape (N,).
+    apriori_volcano_idx : array of int
+        Indices of the a priori analogues.
+    method : str, optional
+        'midpoint' (default) reproduces get_analogy_percentile: the value of
+        each a priori analogue is matched to the closest of the percentiles
+        from 0 to 100 of the distribution (calculated with the 'midpoint'
+        method, as in VOLCANS), and the integer percentile is returned.
+        'rank' returns the percentage of volcanoes with a total analogy lower
+        than or equal to that of each a priori analogue, found by binary
+        search in the sorted values, so that (100 - percentile) is exactly the
+        percentage of better analogues.
+    analogy_percentiles : array, optional
+        Percentiles from 0 to 100 of total_analogy, if already calculated
+        (only used by the 'midpoint' method).
+
+    Returns
+    -------
+    percentiles : array
+        Percentile of each a priori analogue (int for 'midpoint' and float
+        for 'rank').
+    """
+    total_analogy = np.asarray(total_analogy)
+    apriori_values = total_analogy[np.asarray(apriori_volcano_idx, dtype=int)]
+
+    if method == 'midpoint':
+        if analogy_percentiles is None:
+            analogy_percentiles = np.percentile(total_analogy,
+                                                np.linspace(0, 100, 101),
+                                                interpolation='midpoint')
+        # NB. Percentiles are sorted, so the closest one to each value is one
+        # of its two neighbours. As with argmin in get_analogy_percentile,
+        # the lowest percentile wins when there are several equally close.
+        upper = np.searchsorted(analogy_percentiles, apriori_values)
+        upper = np.minimum(upper, len(analogy_percentiles) - 1)
+        lower = np.maximum(upper - 1, 0)
+        lower = np.searchsorted(analogy_percentiles,
+                                analogy_percentiles[lower])
+        take_lower = \
+            np.abs(analogy_percentiles[lower] - apriori_values) <= \
+            np.abs(analogy_percentiles[upper] - apriori_values)
+        return np.where(take_lower, lower, upper)
+
+    if method == 'rank':
+        sorted_values = np.sort(total_analogy)
+        lower_or_equal = np.searchsorted(sorted_values, apriori_values,
+                                         side='right')
+        return 100 * lower_or_equal / len(sorted_values)
+
+    msg = (f"Unknown percentile method: {method} "
+           f"(choose from {', '.join(PERCENTILE_METHODS)})")
+    raise PyvolcansError(msg)
+
+
 def get_analogy_percentile(my_volcano, apriori_volcano,
-                           volcans_result):
+                           volcans_result, weights=None):
     """
     Takes the target volcano and another volcano (an 'a priori analogue'), and
     calculates the percentile that the total analogy between the two volcanoes
@@ -998,6 +2388,12 @@ def get_analogy_percentile(my_volcano, apriori_volcano,
         weights (or weighting scheme) that is chosen by the user for each
         particular run of PyVOLCANS. A different weighting scheme can generate
         an entirely different set of total analogy values.
+    weights : dict, optional
+        Weighting scheme used to calculate volcans_result. If given, the
+        total analogy values of the target volcano and their percentiles are
+        taken from ANALOGY_CACHE, and a PyvolcansError is raised if the
+        total analogy value of the a priori analogue in volcans_result does
+        not match that calculated with the weights.
 
     Returns
     -------
@@ -1022,12 +2418,22 @@ def get_analogy_percentile(my_volcano, apriori_volcano,
     # convert volcano names into indices to access the weighted_analogy_matrix
     apriori_volcano_idx = convert_to_idx(apriori_volcano)
 
-    # derive a vector with the analogy values for the target volcano
-    my_analogy_values = volcans_result['total_analogy']
-    # calculate percentiles from 0 to 100 (same method as in VOLCANS currently)
-    analogy_percentiles = np.percentile(my_analogy_values,
-                                        np.linspace(0, 100, 101),
-                                        interpolation='midpoint')
+    if weights is None and isinstance(volcans_result, AnalogyResult):
+        weights = volcans_result.weights
+    if weights is None:
+        # derive a vector with the analogy values for the target volcano
+        my_analogy_values = volcans_result['total_analogy']
+        # calculate percentiles from 0 to 100 (same method as in VOLCANS
+        # currently)
+        analogy_percentiles = np.percentile(my_analogy_values,
+                                            np.linspace(0, 100, 101),
+                                            interpolation='midpoint')
+    else:
+        # reuse the values and percentiles of previous queries
+        my_analogy_values, analogy_percentiles = \
+            ANALOGY_CACHE.get_percentiles(convert_to_idx(my_volcano), weights)
+        _check_total_analogy(volcans_result, [apriori_volcano_idx],
+                             my_analogy_values[[apriori_volcano_idx]])
     # find the closest value to the analogy of the a priori volcano
     # NOTE that this value already represents the percentile (0-100)
     my_percentile = (np.abs(analogy_percentiles -
@@ -1036,10 +2442,13 @@ def get_analogy_percentile(my_volcano, apriori_volcano,
     return my_percentile
 
 
+@timed
 def get_many_analogy_percentiles(my_volcano, apriori_volcanoes_list,
-                                 volcans_result):
+                                 volcans_result, weights=None,
+                                 method='midpoint'):
     """
-    Iteratively calls 'get_analogy_percentile()' function to derive a
+    Calculates the percentiles of all a priori analogues at once (see
+    calculate_analogy_percentiles) to derive a
     dictionary of 'a priori analogues' with their corresponding value of
     percentage of 'better analogues' (to the target volcano) that exist in
     the GVP database (www.volcano.si.edu). NB. 'better analogue' means that
@@ -1062,6 +2471,15 @@ def get_many_analogy_percentiles(my_volcano, apriori_volcanoes_list,
         weights (or weighting scheme) that is chosen by the user for each
         particular run of PyVOLCANS. A different weighting scheme can generate
         an entirely different set of total analogy values.
+    weights : dict, optional
+        Weighting scheme used to calculate volcans_result (see
+        get_analogy_percentile). If given, a PyvolcansError is raised if the
+        total analogy values of the a priori analogues in volcans_result do
+        not match those calculated with the weights.
+    method : str, optional
+        How percentiles are calculated: 'midpoint' (default), as in
+        get_analogy_percentile, or 'rank' (see
+        calculate_analogy_percentiles).
 
     Returns
     -------
@@ -1095,35 +2513,168 @@ def get_many_analogy_percentiles(my_volcano, apriori_volcanoes_list,
     percentile_dictionary = {}
     better_analogues_dictionary = {}  # 100-percentile
 
-    # loop over get_analogy_percentile
-    for volcano in apriori_volcanoes_list:
-        percentile = get_analogy_percentile(my_volcano, volcano,
-                                            volcans_result)
+    # convert volcano names into indices only once
+    my_volcano_idx = convert_to_idx(my_volcano)
+    apriori_volcano_idx = [convert_to_idx(volcano)
+                           for volcano in apriori_volcanoes_list]
+
+    if weights is None and isinstance(volcans_result, AnalogyResult):
+        weights = volcans_result.weights
+    analogy_percentiles = None
+    if weights is None:
+        my_analogy_values = volcans_result['total_analogy'].to_numpy()
+    else:
+        # reuse the values and percentiles of previous queries
+        my_analogy_values, analogy_percentiles = \
+            ANALOGY_CACHE.get_percentiles(my_volcano_idx, weights)
+        _check_total_analogy(volcans_result, apriori_volcano_idx,
+                             my_analogy_values[apriori_volcano_idx])
+
+    percentiles = calculate_analogy_percentiles(
+        my_analogy_values, apriori_volcano_idx, method=method,
+        analogy_percentiles=analogy_percentiles)
+    for volcano, percentile in zip(apriori_volcanoes_list, percentiles):
         percentile_dictionary[volcano] = percentile
         better_analogues_dictionary[volcano] = 100 - percentile
 
     # print the percentage of better analogues for each a priori analogue
-    my_volcano_to_print = \
-        VOLCANO_NAMES.loc[convert_to_idx(my_volcano)][0]
+    my_volcano_to_print = VOLCANO_INFO[my_volcano_idx][0]
     print('\n\nAccording to PyVOLCANS, the following percentage of volcanoes in'
           + f' the GVP database\nare better analogues to {my_volcano_to_print}'
           + ' than the \'a priori\' analogues reported below:\n')
 
+    volcano_indices = dict(zip(apriori_volcanoes_list, apriori_volcano_idx))
     for volcano, percentage in better_analogues_dictionary.items():
+        volcano_idx_to_print = volcano_indices[volcano]
         if isinstance(volcano, int):
-            volcano_idx_to_print = get_volcano_idx_from_number(volcano)
-            name_to_print = \
-                VOLCANO_NAMES.loc[volcano_idx_to_print][0]
+            name_to_print = VOLCANO_INFO[volcano_idx_to_print][0]
         else:
-            volcano_idx_to_print = get_volcano_idx_from_name(volcano)
             name_to_print = volcano
 
-        vnum_to_print = \
-            volcans_result['smithsonian_id'].iloc[volcano_idx_to_print]
+        vnum_to_print = VOLCANO_INFO[volcano_idx_to_print][2]
         print(f'{name_to_print} ({vnum_to_print}): {percentage}%\n')
 
     return percentile_dictionary, better_analogues_dictionary
 
 
+def calculate_analogy_ranks(total_analogy):
+    """
+    Calculates, for every volcano, its exact rank, its empirical percentile
+    and its number of strictly better analogues within the total analogy
+    values of a target volcano, using a single sort of each row.
+
+    All N volcanoes in a row are part of the distribution, as in
+    get_analogy_percentile, so the target volcano itself (whose analogy
+    with itself is normally the highest) usually ranks first.
+
+    Parameters
+    ----------
+    total_analogy : array
+        Total analogy values of one target volcano, with shape (N,), or of T
+        target volcanoes, with shape (T, N).
+
+    Returns
+    -------
+    rank : array of int
+        Rank of each volcano, from 1 (highest total analogy). Volcanoes with
+        equal total analogy share the highest rank of their group.
+    percentile : array of float
+        Percentage of volcanoes with a total analogy lower than or equal to
+        that of each volcano (empirical cumulative distribution function).
+    better_analogues : array of int
+        Number of volcanoes with a strictly higher total analogy.
+    """
+    total_analogy = np.asarray(total_analogy)
+    rows = np.atleast_2d(total_analogy)
+    n_volcanoes = rows.shape[1]
+
+    order = np.argsort(rows, axis=1, kind='stable')
+    sorted_values = np.take_along_axis(rows, order, axis=1)
+
+    # the number of values lower than or equal to each sorted value is the
+    # position of the last value of its group of equal values, plus one
+    group_end = np.ones(sorted_values.shape, dtype=bool)
+    group_end[:, :-1] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    end_positions = np.where(group_end, np.arange(n_volcanoes), n_volcanoes)
+    sorted_lower_or_equal = \
+        np.minimum.accumulate(end_positions[:, ::-1], axis=1)[:, ::-1] + 1
+
+    lower_or_equal = np.empty(rows.shape, dtype=int)
+    np.put_along_axis(lower_or_equal, order, sorted_lower_or_equal, axis=1)
+
+    better_analogues = n_volcanoes - lower_or_equal
+    rank = better_analogues + 1
+    percentile = 100 * lower_or_equal / n_volcanoes
+
+    if total_analogy.ndim == 1:
+        return rank[0], percentile[0], better_analogues[0]
+    return rank, percentile, better_analogues
+
+
+@timed
+def get_analogy_ranks(targets, weights, analogies=None, tidy=False):
+    """
+    Derives the rank, percentile and number of better analogues of every
+    volcano in the GVP database as an analogue to each of many target
+    volcanoes (see calculate_analogy_ranks), instead of calling
+    get_analogy_percentile for each pair of volcanoes.
+
+    Parameters
+    ----------
+    targets : list of str or int
+        Target volcanoes, as volcano names or volcano numbers
+    weights : dict or array-like
+        Set of weights (weighting scheme) selected by the user to run
+        PyVOLCANS, as a dictionary or as an array in the order of CRITERIA
+    analogies : dict, optional
+        Single-criterion analogy matrices (see
+        calculate_weighted_analogy_batch).
+    tidy : bool, optional
+        If True, return the result as a long-format Pandas dataframe instead
+        of arrays (see Returns).
+
+    Returns
+    -------
+    rank : array of int
+        Rank of each volcano as an analogue to each target, with shape (T, N).
+    percentile : array of float
+        Percentile of each volcano for each target, with shape (T, N).
+    better_analogues : array of int
+        Number of strictly better analogues than each volcano for each target,
+        with shape (T, N).
+
+    If tidy is True, a single Pandas dataframe is returned instead, with one
+    row per target volcano and volcano in the GVP database (T * N rows) and
+    the columns 'target_name', 'target_smithsonian_id', 'name', 'country',
+    'smithsonian_id', 'total_analogy', 'rank', 'percentile' and
+    'better_analogues'.
+    """
+    volcano_indices = resolve_targets(targets)
+    weighted_total_analogy, _ = \
+        _calculate_weighted_analogy_batch(targets, volcano_indices, weights,
+                                          analogies)
+    rank, percentile, better_analogues = \
+        calculate_analogy_ranks(weighted_total_analogy)
+
+    if not tidy:
+        return rank, percentile, better_analogues
+
+    n_volcanoes = len(VOLCANO_NAMES)
+    volcans_result = pd.concat([RESULT_NAMES] * len(volcano_indices),
+                               ignore_index=True)
+    volcans_result.insert(
+        0, 'target_name',
+        np.repeat(VOLCANO_NAMES[0].values[volcano_indices], n_volcanoes))
+    volcans_result.insert(
+        1, 'target_smithsonian_id',
+        np.repeat(VOLCANO_NAMES[2].values[volcano_indices], n_volcanoes))
+    volcans_result['total_analogy'] = weighted_total_analogy.ravel()
+    volcans_result['rank'] = rank.ravel()
+    volcans_result['percentile'] = percentile.ravel()
+    volcans_result['better_analogues'] = better_analogues.ravel()
+
+    return volcans_result
+
+
 class PyvolcansError(Exception):
     """Base class for all PyVOLCANS errors"""
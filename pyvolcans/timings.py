@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the PyVOLCANS processing stages, reported by the command line
+interface when the `--timings` option is used.
+
+Wall time is recorded for the functions decorated with `timed` once
+`TIMER.enabled` is set by the command line interface; until then, they are
+called directly, so that functions called many times (e.g. to resolve
+volcano names) have no overhead. The stages run while importing pyvolcans
+are reported together, as the time elapsed since IMPORT_START. Memory is only traced (with tracemalloc) once
+`TIMER.start_memory_tracing()` has been called, as tracing slows down
+the program.
+
+@author: Pablo Tierz, John A. Stevenson, Vyron Christodoulou
+         (British Geological Survey, The Lyell Centre,
+         Edinburgh, UK).
+"""
+import functools
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# time at which the import of the pyvolcans package started
+IMPORT_START = time.perf_counter()
+
+
+class StageTimer:
+    """
+    Accumulates the number of calls, total wall time and peak memory
+    allocated during each named stage. Stages may be nested, in which case
+    the time and memory of the inner stages are also included in the outer
+    ones.
+    """
+
+    def __init__(self, enabled=True):
+        self.stages = OrderedDict()
+        # whether functions decorated with `timed` are recorded
+        self.enabled = enabled
+        self.trace_memory = False
+        # absolute peak of traced memory seen by each running stage
+        self._peaks = []
+
+    def start_memory_tracing(self):
+        """Starts tracing the memory allocated by Python and NumPy."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.trace_memory = True
+
+    def record(self, name, seconds, peak_bytes=None, first=False):
+        """
+        Adds a call of the named stage. If first is True, the stage is moved
+        to the start of the report.
+        """
+        stage = self._get_stage(name)
+        if first:
+            self.stages.move_to_end(name, last=False)
+        stage['calls'] += 1
+        stage['seconds'] += seconds
+        if peak_bytes is not None:
+            stage['peak_bytes'] = max(stage['peak_bytes'] or 0, peak_bytes)
+
+    def _get_stage(self, name):
+        return self.stages.setdefault(name, {'calls': 0, 'seconds': 0.,
+                                             'peak_bytes': None})
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that records the code it runs as a stage."""
+        # outer stages are listed before the stages nested in them
+        self._get_stage(name)
+        trace_memory = self.trace_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            start_bytes, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            _reset_peak()
+            self._peaks.append(start_bytes)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_bytes = None
+            if trace_memory:
+                peak = max(self._peaks.pop(),
+                           tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                _reset_peak()
+                peak_bytes = peak - start_bytes
+            self.record(name, seconds, peak_bytes)
+
+    def report(self):
+        """Returns the recorded stages formatted as a table."""
+        lines = ['Timings (nested stages are included in outer ones):',
+                 f"{'stage':<36}{'calls':>7}{'time (ms)':>12}"
+                 f"{'peak memory (MB)':>18}"]
+        for name, stage in self.stages.items():
+            if stage['peak_bytes'] is None:
+                peak_memory = '-'
+            else:
+                peak_memory = f"{stage['peak_bytes'] / 1e6:.2f}"
+            lines.append(f"{name:<36}{stage['calls']:>7}"
+                         f"{stage['seconds'] * 1e3:>12.2f}{peak_memory:>18}")
+
+        max_rss = get_max_rss()
+        if max_rss is not None:
+            lines.append(f'Peak resident memory of the process: '
+                         f'{max_rss / 1e6:.1f} MB')
+
+        return '\n'.join(lines)
+
+
+def _reset_peak():
+    # tracemalloc.reset_peak is only available from Python 3.9
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+def get_max_rss():
+    """Returns the peak resident memory of the process in bytes, if known."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+TIMER = StageTimer(enabled=False)
+
+
+def timed(func):
+    """
+    Decorator that records each call of func as a stage of TIMER, if TIMER
+    is enabled.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TIMER.enabled:
+            return func(*args, **kwargs)
+        with TIMER.stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -51,6 +51,8 @@ setup(
     entry_points={
         "console_scripts": [
             "pyvolcans=pyvolcans.pyvolcans:cli",
+            "pyvolcans-cache=pyvolcans.pyvolcans_cache:cli",
+            "pyvolcans-export=pyvolcans.pyvolcans_export:cli",
         ]
     },
 )
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the loading of the VOLCANS data.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from pymatreader import read_mat
+
+import pyvolcans.VOLCANS_mat_files.base as base
+from pyvolcans.VOLCANS_mat_files.base import (
+    DIRNAME_ANALOGY,
+    AnalogyStack,
+    DataBundle,
+    HDF5Backend,
+    LazyCriteria,
+    MatBackend,
+    NpyBackend,
+    SymmetricAnalogyMatrix,
+    TopAnalogueTable,
+    decode_analogies,
+    encode_analogies,
+    find_bundle,
+    find_top_analogue_table,
+    get_bundle,
+    get_backend,
+    get_analogy_order_index,
+    get_cache_dir,
+    get_source_key,
+    get_source_manifest,
+    get_top_analogues_path,
+    get_top_analogues_stem,
+    get_weights_key,
+    list_artefacts,
+    load_geochemistry_analogy,
+    load_morphology_data,
+    load_tectonic_analogy,
+    load_volcano_names,
+    pack_bundle,
+    set_backend,
+    verify_analogy_storage,
+)
+
+
+@pytest.fixture
+def tmp_cache_dir(monkeypatch, tmp_path):
+    """Use an empty cache directory and forget any bundle already opened."""
+    monkeypatch.setenv('PYVOLCANS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(base, '_BUNDLES', {})
+    return tmp_path
+
+
+def test_get_cache_dir(tmp_cache_dir):
+    assert get_cache_dir() == tmp_cache_dir
+
+
+def test_pack_bundle():
+    # Arrange
+    blocks = {'matrix': np.arange(12, dtype=np.float64).reshape(3, 4),
+              'vector': np.arange(5, dtype=np.int16),
+              'text': np.frombuffer(b'Hekla,Iceland', dtype=np.uint8)}
+
+    # Act
+    bundle = DataBundle(pack_bundle(blocks))
+
+    # Assert
+    for name, array in blocks.items():
+        assert bundle.layout[name]['offset'] % 64 == 0
+        np.testing.assert_array_equal(bundle.block(name), array)
+        assert bundle.block(name).dtype == array.dtype
+    assert bundle.block('text').tobytes() == b'Hekla,Iceland'
+
+
+def test_load_analogy_from_bundle(tmp_cache_dir):
+    # Arrange
+    expected = read_mat(
+        DIRNAME_ANALOGY.joinpath('ATfinal_allvolcs.mat'))['AT_allcross']
+
+    # Act
+    analogy = load_tectonic_analogy()
+    volcano_names = load_volcano_names()
+
+    # Assert
+    assert len(list(tmp_cache_dir.glob('pyvolcans_bundle_v3_float64_*.bin'))) == 1
+    assert isinstance(analogy, SymmetricAnalogyMatrix)
+    assert not analogy.packed.flags.writeable
+    np.testing.assert_array_equal(analogy.to_dense(), expected)
+    assert volcano_names.shape == (1439, 3)
+    assert volcano_names.iloc[0, 0] == 'West Eifel Volcanic Field'
+
+
+def test_load_names_and_data_without_bundle(tmp_cache_dir):
+    # Act
+    volcano_names = load_volcano_names()
+    morphology_data = load_morphology_data()
+    cache_files = list(tmp_cache_dir.glob('pyvolcans_bundle_*.bin'))
+    bundle = get_bundle()
+
+    # Assert
+    # the names and data are read from their source files, without building
+    # the bundle (which reads the analogy matrices too)
+    assert cache_files == []
+    assert volcano_names.equals(
+        pd.read_csv(io.BytesIO(bundle.block('volcano_names').tobytes()),
+                    header=None))
+    np.testing.assert_array_equal(morphology_data,
+                                  bundle.block('data/morphology'))
+    assert find_bundle() is bundle
+
+
+def test_symmetric_analogy_matrix():
+    # Arrange
+    rng = np.random.default_rng(42)
+    values = rng.random((6, 6))
+    dense = (values + values.T) / 2
+
+    # Act
+    matrix = SymmetricAnalogyMatrix.from_dense(dense)
+
+    # Assert
+    assert matrix.shape == (6, 6)
+    assert matrix.packed.size == 21
+    np.testing.assert_array_equal(matrix.to_dense(), dense)
+    for idx in range(6):
+        np.testing.assert_array_equal(matrix.row(idx), dense[idx])
+        np.testing.assert_array_equal(matrix[idx, ], dense[idx])
+    np.testing.assert_array_equal(matrix.rows([4, 1]), dense[[4, 1]])
+
+
+def test_symmetric_analogy_matrix_arithmetic():
+    # Arrange
+    dense = np.array([[1., 0.5, 0.2],
+                      [0.5, 1., 0.],
+                      [0.2, 0., 0.8]])
+    matrix = SymmetricAnalogyMatrix.from_dense(dense)
+
+    # Act
+    weighted = 0.2 * matrix + matrix * 0.8 + 0.
+
+    # Assert
+    assert isinstance(weighted, SymmetricAnalogyMatrix)
+    np.testing.assert_array_equal(weighted.to_dense(),
+                                  0.2 * dense + dense * 0.8)
+
+
+def test_analogy_stack():
+    # Arrange
+    matrices = [SymmetricAnalogyMatrix.from_dense(np.full((4, 4), i) +
+                                                  np.eye(4))
+                for i in range(5)]
+    stack = AnalogyStack(np.stack([matrix.packed for matrix in matrices]))
+
+    # Act
+    rows = stack.rows([2, 0])
+
+    # Assert
+    assert stack.shape == (5, 4, 4)
+    assert rows.shape == (2, 5, 4)
+    assert rows.flags.c_contiguous
+    for i, criterion in enumerate(base.CRITERIA):
+        np.testing.assert_array_equal(stack[criterion].row(2), rows[0, i])
+        np.testing.assert_array_equal(matrices[i].row(0), rows[1, i])
+    assert stack.rows(3).shape == (5, 4)
+    # only the rows of the criteria selected are read, the others are zeros
+    selected = stack.rows([2, 0], [True, False, False, True, False])
+    assert selected.flags.c_contiguous
+    np.testing.assert_array_equal(selected[:, [0, 3]], rows[:, [0, 3]])
+    assert not selected[:, [1, 2, 4]].any()
+
+
+def test_symmetric_analogy_matrix_not_triangular():
+    with pytest.raises(ValueError):
+        SymmetricAnalogyMatrix(np.zeros(5))
+
+
+@pytest.mark.parametrize('storage, max_error', [
+    ('float64', 0),
+    ('float32', 6e-8),
+    ('float16', 2.5e-4),
+    ('uint16', 0.5 / 65535)])
+def test_encode_analogies(storage, max_error):
+    values = np.linspace(0, 1, 1001)
+
+    decoded = decode_analogies(encode_analogies(values, storage))
+
+    assert decoded.dtype == np.float64
+    assert np.abs(decoded - values).max() <= max_error
+
+
+def test_load_analogy_with_storage(tmp_cache_dir, monkeypatch):
+    # Arrange
+    monkeypatch.setenv('PYVOLCANS_ANALOGY_STORAGE', 'uint16')
+
+    # Act
+    analogy = load_geochemistry_analogy()
+    volcano_names = load_volcano_names()
+    morphology_data = load_morphology_data()
+
+    # Assert
+    # the names and data are read from the same bundle as the analogies
+    assert len(list(tmp_cache_dir.glob('pyvolcans_bundle_*.bin'))) == 1
+    assert len(list(tmp_cache_dir.glob('pyvolcans_bundle_v3_uint16_*.bin'))) == 1
+    assert volcano_names.shape == (1439, 3)
+    assert morphology_data.dtype == np.float64
+    assert analogy.dtype == np.uint16
+    assert analogy.row(0).dtype == np.float64
+    assert analogy.row(0)[0] == 1.
+
+
+def test_verify_analogy_storage():
+    weights = {'tectonic_setting': 0.2, 'geochemistry': 0.2,
+               'morphology': 0.2, 'eruption_size': 0.2,
+               'eruption_style': 0.2}
+
+    report = verify_analogy_storage('uint16', [weights], count=5)
+
+    assert report['storage'] == 'uint16'
+    assert 0 < report['max_abs_error']['total_analogy'] <= 0.5 / 65535
+    for change in report['rank_changes']:
+        assert change['float64'] != change['uint16']
+
+
+def test_get_source_manifest(tmp_cache_dir):
+    # Act
+    manifest = get_source_manifest()
+    source_key = get_source_key(manifest)
+
+    # Assert
+    assert tmp_cache_dir.joinpath('manifest.json').exists()
+    assert 'analogy_mats/ATfinal_allvolcs.mat' in manifest
+    assert 'data_mats/AMmatrices_QUET.mat' in manifest
+    assert 'VOTW_prepared_data/volc_names.csv' in manifest
+    assert len(manifest['VOTW_prepared_data/volc_names.csv']['sha256']) == 64
+    # only the files read by PyVOLCANS (and shipped with it) are hashed
+    assert len(manifest) == 11
+    assert 'VOTW_prepared_data/VOTW467_8May18_volcano_data.csv' \
+        not in manifest
+    assert get_source_key() == source_key
+    assert len(source_key) == 16
+
+
+def test_get_bundle_rebuilt_on_source_change(tmp_cache_dir, monkeypatch):
+    # Arrange
+    get_bundle('float64')
+    old_key = get_source_key()
+    monkeypatch.setattr(base, '_BUNDLES', {})
+    monkeypatch.setattr(base, 'get_source_key',
+                        lambda manifest=None: 'new_source_hash')
+
+    # Act
+    bundle = get_bundle('float64')
+
+    # Assert
+    assert bundle.metadata['source_key'] == 'new_source_hash'
+    # NB. The bundle of the old sources is kept until purged
+    bundle_files = sorted(tmp_cache_dir.glob('pyvolcans_bundle_*.bin'))
+    assert [path.name for path in bundle_files] == \
+        [f'pyvolcans_bundle_v3_float64_{old_key}.bin',
+         'pyvolcans_bundle_v3_float64_new_source_hash.bin']
+    assert list_artefacts(old_key) == [(bundle_files[0], True),
+                                       (bundle_files[1], False)]
+
+
+def _write_npy(path):
+    return NpyBackend.write(path / 'npy')
+
+
+def _write_packed_npy(path):
+    return NpyBackend.write(path / 'npy', packed=True)
+
+
+def _write_hdf5(path):
+    pytest.importorskip('h5py')
+    return HDF5Backend.write(path / 'volcans.h5')
+
+
+@pytest.mark.parametrize('write_backend',
+                         [_write_npy, _write_packed_npy, _write_hdf5])
+def test_data_backends(write_backend, tmp_path):
+    from pyvolcans.pyvolcans_func import (
+        WEIGHTS, calculate_weighted_analogy_matrix)
+
+    backend = write_backend(tmp_path)
+    default = MatBackend()
+    analogies = LazyCriteria({criterion: (lambda c=criterion:
+                                          backend.read_analogy(c))
+                              for criterion in base.CRITERIA})
+
+    assert backend.read_volcano_names().equals(default.read_volcano_names())
+    for criterion in base.CRITERIA:
+        np.testing.assert_array_equal(backend.read_data(criterion),
+                                      default.read_data(criterion))
+        np.testing.assert_array_equal(
+            backend.read_analogy(criterion)[[3, 1, 3]],
+            default.read_analogy(criterion)[[3, 1, 3]])
+    result = calculate_weighted_analogy_matrix('Hekla', WEIGHTS, analogies)
+    expected = calculate_weighted_analogy_matrix('Hekla', WEIGHTS)
+    assert result.equals(expected)
+
+
+def test_set_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, '_BACKEND', None)
+    monkeypatch.setenv('PYVOLCANS_DATA_BACKEND', f'npy:{tmp_path}')
+    assert isinstance(get_backend(), NpyBackend)
+
+    set_backend('mat')
+    assert isinstance(get_backend(), MatBackend)
+    set_backend(None)
+    monkeypatch.delenv('PYVOLCANS_DATA_BACKEND')
+    assert isinstance(get_backend(), MatBackend)
+
+    with pytest.raises(ValueError, match='Unknown data backend'):
+        set_backend('npy')
+
+
+def test_top_analogue_table(tmp_path):
+    # Arrange
+    filename = tmp_path / 'top_analogues.bin'
+    indices = np.array([[1, 2], [2, 0], [1, 0]])
+    values = np.array([[0.9, 0.5], [0.7, 0.5], [0.7, 0.3]])
+
+    # Act
+    TopAnalogueTable.write(filename, indices, values, [0.2] * 5, 'abc',
+                           'float32')
+    table = TopAnalogueTable.open(filename)
+    top_indices, top_values = table.top(1, 1)
+
+    # Assert
+    assert table.indices.dtype == np.int16
+    assert table.values.dtype == np.float32
+    assert table.count == 2
+    assert table.source_key == 'abc'
+    assert table.storage == 'float32'
+    assert top_indices.tolist() == [2]
+    np.testing.assert_allclose(top_values, [0.7], rtol=1e-7)
+
+
+def test_analogy_order_index(tmp_cache_dir, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(base, '_ANALOGY_ORDER_INDICES', {})
+    analogy = load_tectonic_analogy()
+    row = analogy.row(100)
+
+    # Act
+    order_index = get_analogy_order_index()
+    indices, values = order_index.above('tectonic_setting', 100, 0.5)
+
+    # Assert
+    assert len(list(tmp_cache_dir.glob('analogy_order_v1_float64_*.bin'))) == 1
+    order = order_index.orders['tectonic_setting']
+    assert order.dtype == np.int16
+    assert order.shape == analogy.shape
+    np.testing.assert_array_equal(order[100],
+                                  np.argsort(-row, kind='stable'))
+    np.testing.assert_array_equal(indices, order[100][:np.sum(row >= 0.5)])
+    np.testing.assert_array_equal(values, row[indices])
+    np.testing.assert_array_equal(analogy.values(100, [3, 200]),
+                                  row[[3, 200]])
+
+
+def test_shipped_top_analogue_tables_are_current(tmp_cache_dir):
+    # The tables shipped with PyVOLCANS are only used if they were built from
+    # the same source files as those shipped
+    tables = sorted(base.DIRNAME_TOP_ANALOGUES.glob('*.bin'))
+
+    assert tables
+    for filename in tables:
+        table = TopAnalogueTable.open(filename)
+        assert table.source_key == get_source_key()
+        assert filename.stem == get_top_analogues_stem(table.weights,
+                                                       table.storage)
+
+
+def test_find_top_analogue_table_storage(tmp_cache_dir, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(base, '_TOP_ANALOGUE_TABLES', {})
+    shipped = base.DIRNAME_TOP_ANALOGUES.joinpath(
+        f"{get_top_analogues_stem([0.2] * 5, 'float64')}.bin")
+    # a table built from float64 values, saved under the uint16 name
+    mislabelled = get_top_analogues_path([0.2] * 5, storage='uint16')
+    mislabelled.write_bytes(shipped.read_bytes())
+
+    # Act
+    float64_table = find_top_analogue_table([0.2] * 5)
+    monkeypatch.setenv('PYVOLCANS_ANALOGY_STORAGE', 'uint16')
+    uint16_table = find_top_analogue_table([0.2] * 5)
+
+    # Assert
+    assert float64_table.storage == 'float64'
+    assert uint16_table is None
+
+
+def test_get_weights_key():
+    assert get_weights_key([0.2] * 5) == get_weights_key([0.2 + 1e-12] * 5)
+    assert get_weights_key([1, 0, 0, 0, 0]) == get_weights_key(
+        [1, -0., 0, 0, 0])
+    assert get_weights_key([0.2] * 5) != get_weights_key([1, 0, 0, 0, 0])
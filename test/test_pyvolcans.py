@@ -21,7 +21,8 @@ from pathlib import Path
          ("Vesuvius -M 1 -v", "'morphology': 1.0"),
          ("Vesuvius -Sz 1 -v", "'eruption_size': 1.0"),
          ("Vesuvius -St 1 -v", "'eruption_style': 1.0"),
-         ("Fuego --count 50", "Top 50")])
+         ("Fuego --count 50", "Top 50"),
+         ("Hekla --timings", "calculate_weighted_analogy_matrix")])
 def test_pyvolcans_output(input_args, expected, capfd):
     subprocess.run(['pyvolcans', *input_args.split()])
     out, err = capfd.readouterr()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the pyvolcans-cache command line tool.
+"""
+import os
+import subprocess
+
+
+def run_cache_command(args, cache_dir):
+    env = dict(os.environ, PYVOLCANS_CACHE_DIR=str(cache_dir))
+    return subprocess.run(['pyvolcans-cache', *args.split()], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def test_pyvolcans_cache(tmp_path):
+    # Act / Assert
+    output = run_cache_command('info', tmp_path).stdout
+    assert 'analogy_mats/ATfinal_allvolcs.mat' in output
+    assert '(none)' in output
+
+    output = run_cache_command('warm', tmp_path).stdout
+    assert 'Data bundle ready (float64)' in output
+    assert 'current' in run_cache_command('info', tmp_path).stdout
+
+    run_cache_command('purge --stale', tmp_path)
+    assert list(tmp_path.glob('pyvolcans_bundle_*.bin'))
+
+    output = run_cache_command('purge', tmp_path).stdout
+    assert 'Removed pyvolcans_bundle_v3_float64_' in output
+    assert not list(tmp_path.glob('pyvolcans_bundle_*.bin'))
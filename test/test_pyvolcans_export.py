@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the pyvolcans-export command line tool.
+"""
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+
+def test_pyvolcans_export_matrix(tmp_path, capfd):
+    # Arrange
+    filename = tmp_path / 'total_analogy.npy'
+
+    # Act
+    subprocess.run(['pyvolcans-export', 'matrix', str(filename),
+                    '-Ts', '1', '--block-size', '500'])
+    out, _ = capfd.readouterr()
+    total_analogy = np.load(filename)
+
+    # Assert
+    assert 'Total analogy matrix written to' in out
+    assert total_analogy.shape == (1439, 1439)
+    np.testing.assert_array_equal(total_analogy, total_analogy.T)
+
+
+def test_pyvolcans_export_matrix_hdf5(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    filename = tmp_path / 'total_analogy.h5'
+
+    subprocess.run(['pyvolcans-export', 'matrix', str(filename)])
+
+    with h5py.File(filename, 'r') as h5_file:
+        dataset = h5_file['total_analogy']
+        assert dataset.shape == (1439, 1439)
+        assert dataset.attrs['weights'].tolist() == [0.2] * 5
+
+
+@pytest.mark.parametrize("input_args,expected",
+                         [("matrix out.npy -G 99", "PyVOLCANS: Sum of weights"),
+                          ("matrix out.csv", "Unsupported file format")])
+def test_pyvolcans_export_errors(input_args, expected, tmp_path, capfd):
+    subprocess.run(['pyvolcans-export', *input_args.split()], cwd=tmp_path)
+    _, err = capfd.readouterr()
+
+    assert expected in err
+
+
+def test_pyvolcans_export_topk(tmp_path, capfd):
+    # Arrange
+    env = dict(os.environ, PYVOLCANS_CACHE_DIR=str(tmp_path))
+
+    # Act
+    subprocess.run(['pyvolcans-export', 'topk', '-Ts', '0.5', '-G', '0.5',
+                    '--count', '20'], env=env)
+    out, _ = capfd.readouterr()
+
+    # Assert
+    assert 'Table of top analogues ready' in out
+    assert list(tmp_path.glob('top_analogues_v2_float64_*.bin'))
+
+
+def test_pyvolcans_export_topk_larger_than_shipped(tmp_path, capfd):
+    # Arrange
+    env = dict(os.environ, PYVOLCANS_CACHE_DIR=str(tmp_path))
+
+    # Act
+    # NB. The table shipped for the equal-weight scheme has the top 100
+    subprocess.run(['pyvolcans-export', 'topk', '--count', '150'], env=env)
+    out, _ = capfd.readouterr()
+
+    # Assert
+    assert '(top 150)' in out
+    assert list(tmp_path.glob('top_analogues_v2_float64_*.bin'))
@@ -6,6 +6,11 @@ Created on Fri May 15 12:49:55 2020
          (British Geological Survey, The Lyell Centre,
          Edinburgh, UK).
 """
+import multiprocessing
+import pickle
+import subprocess
+import sys
+
 import pytest
 
 import numpy as np
@@ -13,23 +18,51 @@ import pandas as pd
 from pandas.testing import assert_frame_equal
 from pyvolcans.pyvolcans_func import (
     fuzzy_matching,
+    get_volcano_name_index,
+    get_similar_volcano_idx,
+    _import_thefuzz,
     match_name,
     format_volcano_name,
     get_volcano_idx_from_name,
     get_volcano_name_from_idx,
     get_volcano_number_from_name,
     get_volcano_idx_from_number,
+    build_volcano_lookups,
+    resolve_volcanoes,
     get_many_analogy_percentiles,
     get_volcano_source_data,
     get_analogies,
+    get_analogues_above,
     calculate_weighted_analogy_matrix,
+    AnalogyCache,
+    AnalogyResult,
+    calculate_analogy_percentiles,
+    calculate_analogy_ranks,
+    get_analogy_ranks,
+    get_analogy_percentile,
+    convert_to_idx,
+    calculate_weighted_analogy_batch,
+    calculate_weighted_analogy_rows,
+    calculate_weighted_analogy_schemes,
+    build_top_analogue_table,
+    get_top_analogue_table,
+    export_total_analogy_matrix,
+    get_top_analogue_indices,
+    validate_weights_array,
+    weights_to_array,
     open_gvp_website,
     plot_bar_apriori_analogues,
     plot_bar_better_analogues,
     set_weights_from_args,
+    output_result,
     VOLCANO_NAMES,
+    WEIGHTS,
     PyvolcansError
 )
+from pyvolcans import (LazyCriteria, NpyBackend, SharedAnalogyStore,
+                       load_analogy_stack)
+from pyvolcans import pyvolcans_func
+from pyvolcans.VOLCANS_mat_files import base
 
 
 def test_volcano_idx():
@@ -51,6 +84,26 @@ def test_fuzzy_matching():
     assert 'West Eifel Volcanic Field' in volc_matches_limit
 
 
+@pytest.mark.parametrize("volcano_name", [
+    'Hekal', 'Vesuvio', 'Santa Isabel', 'Tolima Nevado', 'St Helens', 'xyz',
+    'São Jorge', ''])
+def test_volcano_name_index(volcano_name):
+    # Arrange
+    fuzz, process = _import_thefuzz()
+    expected = process.extract(volcano_name, VOLCANO_NAMES[0], limit=10,
+                               scorer=fuzz.token_sort_ratio)
+
+    # Act
+    candidates = get_volcano_name_index().candidates(volcano_name)
+    matches = process.extract(volcano_name, VOLCANO_NAMES[0].iloc[candidates],
+                              limit=10, scorer=fuzz.token_sort_ratio)
+
+    # Assert
+    assert matches == expected
+    if volcano_name in ['Hekal', 'Vesuvio']:
+        assert len(candidates) < len(VOLCANO_NAMES) / 2
+
+
 def test_volcano_number():
     number = get_volcano_number_from_name('Santorini')
     assert number == 212040
@@ -112,6 +165,41 @@ def test_volcano_idx_from_number():
     assert idx == 21
 
 
+def test_build_volcano_lookups():
+    idx_by_name, idx_by_number, volcano_info = \
+        build_volcano_lookups(VOLCANO_NAMES)
+
+    assert idx_by_name['Fuego'] == [1071]
+    assert len(idx_by_name['Santa Isabel']) == 2
+    assert idx_by_number[212040] == get_volcano_idx_from_name('Santorini')
+    assert volcano_info[1071] == ('Fuego', 'Guatemala', 342090)
+    assert len(volcano_info) == len(VOLCANO_NAMES)
+
+
+def test_volcano_idx_from_number_error():
+    with pytest.raises(PyvolcansError, match='Volcano number does not exist'):
+        get_volcano_idx_from_number(999999)
+
+
+def test_resolve_volcanoes():
+    # Act
+    volcano_indices, report = resolve_volcanoes(
+        ['Fuego', 212040, 'Santa Isabel', 'Hekal', 999999])
+
+    # Assert
+    assert volcano_indices.tolist() == [1071, convert_to_idx('Santorini'),
+                                        -1, -1, -1]
+    assert [problem['position'] for problem in report.unresolved] == [3, 4]
+    assert len(report.ambiguous) == 1
+    assert len(report.ambiguous[0]['matches']) == 2
+    assert report.to_frame()['problem'].tolist() == \
+        ['not unique', 'not found', 'not found']
+    assert report.suggestions(3).index.tolist() == \
+        get_similar_volcano_idx('Hekal')
+    assert 'Hekla' in report.suggestions(3)['name'].tolist()
+    assert report.suggestions(4).empty
+
+
 @pytest.mark.parametrize("name,expected", [('blah', 'not found'), ('Santa Isabel', 'not unique')])
 def test_match_name(name, expected):
     with pytest.raises(PyvolcansError) as excinfo:
@@ -214,6 +302,503 @@ def test_combined_analogy_matrix_no_tectonic(weights, expected, mock_analogies):
     assert matrix.astype(int) == expected
 
 
+def test_calculate_weighted_analogy_matrix_lazy_loading(mock_analogies):
+    # Arrange
+    lazy_analogies = LazyCriteria(
+        {key: (lambda value=value: value)
+         for key, value in mock_analogies.items()})
+    weights = {'tectonic_setting': 1,
+               'geochemistry': 0,
+               'morphology': 0,
+               'eruption_size': 0,
+               'eruption_style': 0}
+
+    # Act
+    pandas_df = calculate_weighted_analogy_matrix(
+        'West Eifel Volcanic Field', weights, lazy_analogies)
+
+    # Assert
+    assert pandas_df.loc[0, 'total_analogy'] == 40000
+    assert lazy_analogies.is_loaded('tectonic_setting')
+    assert not any(lazy_analogies.is_loaded(criterion)
+                   for criterion in ['geochemistry', 'morphology',
+                                     'eruption_size', 'eruption_style'])
+
+
+def test_calculate_weighted_analogy_rows():
+    # Act
+    weighted_analogies, total_analogy = \
+        calculate_weighted_analogy_rows('Hekla', WEIGHTS)
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', WEIGHTS)
+
+    # Assert
+    assert weighted_analogies.shape == (5, len(volcans_result))
+    np.testing.assert_array_equal(total_analogy,
+                                  volcans_result['total_analogy'])
+    np.testing.assert_array_equal(
+        weighted_analogies,
+        volcans_result[['ATs', 'AG', 'AM', 'ASz', 'ASt']].values.T)
+    np.testing.assert_allclose(weighted_analogies.sum(axis=0), total_analogy)
+
+
+def test_weights_to_array():
+    assert weights_to_array(WEIGHTS).tolist() == [0.2] * 5
+    assert weights_to_array([[1, 0, 0, 0, 0]]).shape == (1, 5)
+    with pytest.raises(PyvolcansError, match='Weights must be given'):
+        weights_to_array([0.5, 0.5])
+
+
+def test_calculate_weighted_analogy_rows_with_array_weights():
+    # Arrange
+    weights = {'tectonic_setting': 0.1, 'geochemistry': 0.3,
+               'morphology': 0.2, 'eruption_size': 0.15,
+               'eruption_style': 0.25}
+    expected = calculate_weighted_analogy_rows('Fuego', weights)
+
+    # Act
+    result = calculate_weighted_analogy_rows(
+        'Fuego', [0.1, 0.3, 0.2, 0.15, 0.25], load_analogy_stack())
+
+    # Assert
+    for array, expected_array in zip(result, expected):
+        np.testing.assert_array_equal(array, expected_array)
+
+
+def test_calculate_weighted_analogy_batch():
+    # Arrange
+    targets = ['Hekla', 372050, 'Fuego']
+    expected = [calculate_weighted_analogy_matrix(target, WEIGHTS)
+                for target in targets]
+
+    # Act
+    total_analogy, weighted_analogies = \
+        calculate_weighted_analogy_batch(targets, WEIGHTS)
+    tidy_result = calculate_weighted_analogy_batch(targets, WEIGHTS,
+                                                   tidy=True)
+
+    # Assert
+    assert weighted_analogies.shape == (3, 5, len(expected[0]))
+    for i, expected_result in enumerate(expected):
+        np.testing.assert_array_equal(total_analogy[i],
+                                      expected_result['total_analogy'])
+        np.testing.assert_array_equal(
+            weighted_analogies[i],
+            expected_result[['ATs', 'AG', 'AM', 'ASz', 'ASt']].values.T)
+    assert len(tidy_result) == 3 * len(expected[0])
+    fuego_result = tidy_result[tidy_result['target_name'] == 'Fuego']
+    assert_frame_equal(fuego_result.iloc[:, 2:].reset_index(drop=True),
+                       expected[2])
+
+
+def test_calculate_weighted_analogy_batch_unresolved_targets():
+    with pytest.raises(PyvolcansError) as exc_info:
+        calculate_weighted_analogy_batch(['Hekla', 'Hekal', 'Santa Isabel',
+                                          999999], WEIGHTS)
+
+    assert str(exc_info.value).startswith(
+        "The following target volcanoes could not be resolved: "
+        "Hekal (not found), Santa Isabel (not unique), 999999 (not found).")
+
+
+@pytest.mark.parametrize("weights, expected", [
+    ([[0.2] * 5, [0.5, 0.5, 0, 0, -0.1]], "negative values"),
+    ([[0.2] * 5, [0.2] * 5, [0.5, 0.2, 0, 0, 0]], "scheme(s) 2."),
+    ([0.5, 0.5], "Weights must be given")])
+def test_validate_weights_array_errors(weights, expected):
+    with pytest.raises(PyvolcansError) as exc_info:
+        validate_weights_array(weights)
+    assert expected in str(exc_info.value)
+
+
+def test_calculate_weighted_analogy_schemes():
+    # Arrange
+    weights = [[0.2] * 5, [1, 0, 0, 0, 0], [0.1, 0.3, 0.2, 0.15, 0.25]]
+    expected = [calculate_weighted_analogy_rows('Vesuvius', scheme)[1]
+                for scheme in weights]
+
+    # Act
+    total_analogy = calculate_weighted_analogy_schemes('Vesuvius', weights)
+
+    # Assert
+    np.testing.assert_array_equal(total_analogy, expected)
+
+
+def test_get_top_analogue_indices():
+    # Arrange
+    total_analogy = np.array([[0.9, 0.5, 0.7, 0.5, 0.5, 0.1],
+                              [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]])
+
+    # Act
+    top_indices = get_top_analogue_indices(total_analogy, [0, 5], count=3)
+
+    # Assert
+    # ties are ordered by volcano index, and the target volcano is excluded
+    assert top_indices.tolist() == [[2, 1, 3], [4, 3, 2]]
+    assert get_top_analogue_indices(total_analogy[0], 2, 2).tolist() == [0, 1]
+
+
+def test_export_total_analogy_matrix(tmp_path):
+    # Arrange
+    filename = tmp_path / 'total_analogy.npy'
+    weights = [0.1, 0.3, 0.2, 0.15, 0.25]
+
+    # Act
+    export_total_analogy_matrix(filename, weights, block_size=100)
+    total_analogy = np.load(filename, mmap_mode='r')
+
+    # Assert
+    assert total_analogy.shape == (1439, 1439)
+    for volcano in ['Hekla', 'Fuego', 'Vesuvius']:
+        np.testing.assert_array_equal(
+            total_analogy[convert_to_idx(volcano)],
+            calculate_weighted_analogy_rows(volcano, weights)[1])
+    with pytest.raises(PyvolcansError, match='Unsupported file format'):
+        export_total_analogy_matrix(tmp_path / 'total_analogy.csv', weights)
+
+
+@pytest.mark.filterwarnings("ignore:The following selected criteria")
+def test_build_top_analogue_table():
+    # Arrange
+    weights = [0.1, 0.3, 0.2, 0.15, 0.25]
+    volcano_indices = np.arange(len(VOLCANO_NAMES))
+    total_analogy, _ = calculate_weighted_analogy_batch(
+        VOLCANO_NAMES[2].tolist(), weights)
+
+    # Act
+    top_indices, top_values = build_top_analogue_table(
+        weights, count=15, block_size=200, workers=2)
+
+    # Assert
+    assert top_indices.dtype == np.int16 and top_indices.shape == (1439, 15)
+    np.testing.assert_array_equal(
+        top_indices,
+        get_top_analogue_indices(total_analogy, volcano_indices, 15))
+    np.testing.assert_array_equal(
+        top_values,
+        np.take_along_axis(total_analogy, top_indices.astype(int),
+                           axis=1).astype(np.float32))
+
+
+def test_get_analogies_from_top_analogue_table():
+    # Arrange
+    volcans_result = calculate_weighted_analogy_matrix('Fuego', WEIGHTS)
+
+    # Act
+    table = get_top_analogue_table(WEIGHTS)
+    top_analogues, _ = get_analogies('Fuego', volcans_result, 50,
+                                     weights=WEIGHTS)
+
+    # Assert
+    # a table of top analogues is shipped for the equal-weight scheme
+    assert table is not None and table.count == 100
+    expected, _ = get_analogies('Fuego', volcans_result, 50)
+    assert_frame_equal(top_analogues, expected)
+
+
+def test_get_top_analogue_table_larger_count(monkeypatch, tmp_path):
+    # Arrange
+    monkeypatch.setenv('PYVOLCANS_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(base, '_TOP_ANALOGUE_TABLES', {})
+    shipped = get_top_analogue_table(WEIGHTS)
+
+    # Act
+    table = get_top_analogue_table(WEIGHTS, build=True, count=120)
+
+    # Assert
+    # the shipped table (top 100) is not enough, so a larger one is built
+    assert shipped.count == 100
+    assert table.count == 120
+    assert get_top_analogue_table(WEIGHTS) is table
+    np.testing.assert_array_equal(table.values[:, :100], shipped.values)
+    assert get_top_analogue_table(WEIGHTS, build=True, count=50) is table
+
+
+def test_get_top_analogue_table_other_backend(monkeypatch, tmp_path):
+    # Tables hold the top analogues from the data bundle, so they are not
+    # used for data read with another backend
+    monkeypatch.setattr(base, '_BACKEND', NpyBackend(tmp_path))
+
+    assert get_top_analogue_table(WEIGHTS) is None
+
+
+def test_analogy_cache():
+    # Arrange
+    cache = AnalogyCache(maxsize=2)
+    hekla_idx = convert_to_idx('Hekla')
+    expected = calculate_weighted_analogy_rows('Hekla', WEIGHTS)[1]
+
+    # Act
+    total_analogy, order = cache.get(hekla_idx, WEIGHTS)
+    cache.get(hekla_idx, [0.2 + 1e-12] * 5)
+    cache.get(hekla_idx, [1, 0, 0, 0, 0])
+    cache.get(0, WEIGHTS)
+
+    # Assert
+    np.testing.assert_array_equal(total_analogy, expected)
+    assert order[0] == hekla_idx
+    assert not total_analogy.flags.writeable
+    assert cache.info() == {'hits': 1, 'misses': 3, 'maxsize': 2,
+                            'currsize': 2}
+    # the least recently used entry (Hekla, equal weights) was discarded
+    cache.get(hekla_idx, WEIGHTS)
+    assert cache.misses == 4
+    cache.maxsize = 1
+    assert len(cache) == 1
+
+
+def test_get_analogies_and_percentiles_with_weights():
+    # Arrange
+    weights = {'tectonic_setting': 0.1, 'geochemistry': 0.3,
+               'morphology': 0.2, 'eruption_size': 0.15,
+               'eruption_style': 0.25}
+    volcans_result = calculate_weighted_analogy_matrix('Vesuvius', weights)
+
+    # Act
+    top_analogues, _ = get_analogies('Vesuvius', volcans_result, 20,
+                                     weights=weights)
+    percentiles = [get_analogy_percentile('Vesuvius', volcano,
+                                          volcans_result, weights)
+                   for volcano in ['Etna', 'Hekla', 'Campi Flegrei']]
+
+    # Assert
+    expected, _ = get_analogies('Vesuvius', volcans_result, 20)
+    assert_frame_equal(top_analogues, expected)
+    assert percentiles == [get_analogy_percentile('Vesuvius', volcano,
+                                                  volcans_result)
+                           for volcano in ['Etna', 'Hekla', 'Campi Flegrei']]
+
+
+def test_calculate_weighted_analogy_matrix_fills_cache(monkeypatch):
+    # Arrange
+    cache = AnalogyCache()
+    monkeypatch.setattr(pyvolcans_func, 'ANALOGY_CACHE', cache)
+    weights = [0.1, 0.3, 0.2, 0.15, 0.25]
+
+    # Act
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', weights,
+                                                       as_frame=False)
+    get_analogies('Hekla', volcans_result, 10)
+    get_analogy_percentile('Hekla', 'Etna', volcans_result)
+
+    # Assert
+    # the total analogy values calculated are reused, not calculated again
+    assert cache.info() == {'hits': 2, 'misses': 0, 'maxsize': 128,
+                            'currsize': 1}
+    total_analogy, _ = cache.get(convert_to_idx('Hekla'), weights)
+    np.testing.assert_array_equal(total_analogy,
+                                  volcans_result.total_analogy)
+
+
+def test_get_analogies_and_percentiles_with_other_weights():
+    # Arrange
+    volcans_result = calculate_weighted_analogy_matrix('Hekla',
+                                                       [1, 0, 0, 0, 0])
+    match = 'do not match the weighting scheme given'
+
+    # Act and assert
+    with pytest.raises(PyvolcansError, match=match):
+        get_analogies('Hekla', volcans_result, 10, weights=WEIGHTS)
+    with pytest.raises(PyvolcansError, match=match):
+        get_analogy_percentile('Hekla', 'Etna', volcans_result, WEIGHTS)
+    with pytest.raises(PyvolcansError, match=match):
+        get_many_analogy_percentiles('Hekla', ['Etna'], volcans_result,
+                                     WEIGHTS)
+
+
+def test_analogy_result():
+    # Arrange
+    weights = {'tectonic_setting': 0.1, 'geochemistry': 0.3,
+               'morphology': 0.2, 'eruption_size': 0.15,
+               'eruption_style': 0.25}
+    expected = calculate_weighted_analogy_matrix('Hekla', weights)
+
+    # Act
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', weights,
+                                                       as_frame=False)
+
+    # Assert
+    assert isinstance(volcans_result, AnalogyResult)
+    assert len(volcans_result) == len(expected)
+    assert volcans_result.columns == list(expected.columns)
+    assert_frame_equal(volcans_result.to_frame(), expected)
+    assert_frame_equal(volcans_result.to_frame([10, 3]),
+                       expected.iloc[[10, 3]])
+    assert_frame_equal(volcans_result.select([10, 3]).to_frame(),
+                       expected.iloc[[10, 3]])
+    pd.testing.assert_series_equal(volcans_result['AG'], expected['AG'])
+    pd.testing.assert_series_equal(volcans_result.select([5])['country'],
+                                   expected['country'].iloc[[5]])
+
+    top_analogues, _ = get_analogies('Hekla', volcans_result, 10)
+    expected_top, _ = get_analogies('Hekla', expected, 10)
+    assert_frame_equal(top_analogues, expected_top)
+    assert get_analogy_percentile('Hekla', 'Etna', volcans_result) == \
+        get_analogy_percentile('Hekla', 'Etna', expected)
+    assert output_result(False, 'Hekla',
+                         volcans_result.select(top_analogues.index)) == \
+        output_result(False, 'Hekla', top_analogues)
+
+
+def test_plot_bar_apriori_analogues_with_analogy_result():
+    weights = {'tectonic_setting': 0.2, 'geochemistry': 0.2,
+               'morphology': 0.2, 'eruption_size': 0.2,
+               'eruption_style': 0.2}
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', weights,
+                                                       as_frame=False)
+
+    df_bar = plot_bar_apriori_analogues('Hekla', 372070, ['Etna'],
+                                        volcans_result, 'Test_string')
+
+    expected = plot_bar_apriori_analogues('Hekla', 372070, ['Etna'],
+                                          volcans_result.to_frame(),
+                                          'Test_string')
+    assert_frame_equal(df_bar, expected)
+
+
+def test_calculate_analogy_percentiles():
+    # Arrange
+    volcans_result = calculate_weighted_analogy_matrix('Fuego', WEIGHTS)
+    total_analogy = volcans_result['total_analogy'].to_numpy()
+    apriori_volcanoes = ['Etna', 'Hekla', 'Vesuvius', 'Villarrica', 'Fuego']
+    apriori_idx = [convert_to_idx(volcano) for volcano in apriori_volcanoes]
+
+    # Act
+    midpoint = calculate_analogy_percentiles(total_analogy, apriori_idx)
+    rank = calculate_analogy_percentiles(total_analogy, apriori_idx,
+                                         method='rank')
+
+    # Assert
+    expected = [get_analogy_percentile('Fuego', volcano, volcans_result)
+                for volcano in apriori_volcanoes]
+    assert midpoint.tolist() == expected
+    expected_rank = [100 * np.mean(total_analogy <= total_analogy[idx])
+                     for idx in apriori_idx]
+    np.testing.assert_allclose(rank, expected_rank)
+    assert rank[-1] == 100
+    with pytest.raises(PyvolcansError, match='Unknown percentile method'):
+        calculate_analogy_percentiles(total_analogy, apriori_idx,
+                                      method='linear')
+
+
+def test_get_many_analogy_percentiles_rank(capsys):
+    volcans_result = calculate_weighted_analogy_matrix('Fuego', WEIGHTS)
+
+    percentiles, better_analogues = get_many_analogy_percentiles(
+        'Fuego', ['Etna', 351020], volcans_result, method='rank')
+
+    assert list(percentiles) == ['Etna', 351020]
+    for volcano, percentile in percentiles.items():
+        assert better_analogues[volcano] == 100 - percentile
+        assert 0 < percentile <= 100
+    assert 'Etna' in capsys.readouterr().out
+
+
+def test_get_many_analogy_percentiles_selected_rows(capsys):
+    # Arrange
+    volcans_result = calculate_weighted_analogy_matrix('Fuego', WEIGHTS,
+                                                       as_frame=False)
+    top_analogues, _ = get_analogies('Fuego', volcans_result, 10)
+    expected = get_many_analogy_percentiles('Fuego', ['Etna', 351020],
+                                            volcans_result)
+    capsys.readouterr()
+
+    # Act
+    result = get_many_analogy_percentiles(
+        'Fuego', ['Etna', 351020], volcans_result.select(top_analogues.index))
+
+    # Assert
+    assert result == expected
+    out = capsys.readouterr().out
+    assert 'Etna (211060)' in out
+    assert 'Ruiz, Nevado del (351020)' in out
+
+
+def test_calculate_weighted_analogy_matrix_other_backend(monkeypatch,
+                                                         tmp_path):
+    # Arrange
+    expected = calculate_weighted_analogy_matrix('Hekla', WEIGHTS,
+                                                 as_frame=False)
+    # NB. The default analogy matrices are loaded from the data bundle
+    # before the backend is changed (data already loaded are kept)
+    for criterion in base.CRITERIA:
+        pyvolcans_func.ANALOGY_MATRIX[criterion]
+    monkeypatch.setattr(base, '_BACKEND', NpyBackend(tmp_path))
+
+    # Act
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', WEIGHTS,
+                                                       as_frame=False)
+
+    # Assert
+    # the weights are only kept for results calculated from the data bundle
+    assert expected.weights is not None
+    assert volcans_result.weights is None
+
+
+def test_calculate_analogy_ranks():
+    total_analogy = np.array([0.5, 0.2, 0.5, 0.9, 0.2])
+
+    rank, percentile, better_analogues = \
+        calculate_analogy_ranks(total_analogy)
+
+    assert rank.tolist() == [2, 4, 2, 1, 4]
+    assert percentile.tolist() == [80, 40, 80, 100, 40]
+    assert better_analogues.tolist() == [1, 3, 1, 0, 3]
+
+
+def test_get_analogy_ranks():
+    # Arrange
+    targets = ['Hekla', 'Fuego', 211020]
+    total_analogy, _ = calculate_weighted_analogy_batch(targets, WEIGHTS)
+
+    # Act
+    rank, percentile, better_analogues = get_analogy_ranks(targets, WEIGHTS)
+    tidy = get_analogy_ranks(targets, WEIGHTS, tidy=True)
+
+    # Assert
+    assert rank.shape == total_analogy.shape
+    for i, row in enumerate(total_analogy):
+        expected_better = (row[np.newaxis, :] > row[:, np.newaxis]).sum(axis=1)
+        np.testing.assert_array_equal(better_analogues[i], expected_better)
+        np.testing.assert_array_equal(
+            percentile[i],
+            calculate_analogy_percentiles(row, np.arange(len(row)),
+                                          method='rank'))
+    np.testing.assert_array_equal(rank, better_analogues + 1)
+    assert len(tidy) == total_analogy.size
+    assert tidy['rank'].tolist() == rank.ravel().tolist()
+    assert tidy['target_name'].iloc[-1] == 'Vesuvius'
+
+
+@pytest.mark.parametrize("weights,threshold", [
+    ([0, 0, 0, 0, 1], 0.8),
+    ([0, 1, 0, 0, 0], 0.4),
+    ([0.2, 0.2, 0.2, 0.2, 0.2], 0.7)])
+def test_get_analogues_above(weights, threshold):
+    # Arrange
+    volcans_result = calculate_weighted_analogy_matrix('Fuego', weights)
+    total_analogy = volcans_result['total_analogy'].to_numpy()
+    expected_count = np.sum(total_analogy >= threshold) - 1
+
+    # Act
+    result = get_analogues_above('Fuego', weights, threshold)
+
+    # Assert
+    assert len(result) == expected_count
+    assert convert_to_idx('Fuego') not in result.index
+    assert (result['total_analogy'] >= threshold).all()
+    assert result['total_analogy'].is_monotonic_decreasing
+    assert_frame_equal(result, volcans_result.loc[result.index])
+
+
+@pytest.mark.parametrize("weights,expected", [
+    ([0, 0.5, 0, 0, 0], 'Sum of weights'),
+    ([-0.5, 1.5, 0, 0, 0], 'Some criterion weights are negative'),
+    ([[0, 0, 0, 0, 1], [1, 0, 0, 0, 0]], 'A single weighting scheme')])
+def test_get_analogues_above_invalid_weights(weights, expected):
+    with pytest.raises(PyvolcansError, match=expected):
+        get_analogues_above('Fuego', weights, 0.5)
+
+
 def test_open_gvp_website(monkeypatch):
     # Arrange
     def always_false(my_web):
@@ -222,7 +807,7 @@ def test_open_gvp_website(monkeypatch):
         # webbrowser.open
         return False
 
-    monkeypatch.setattr('pyvolcans.pyvolcans_func.webbrowser.open', always_false)
+    monkeypatch.setattr('webbrowser.open', always_false)
 
     # Act
     with pytest.raises(PyvolcansError) as exc_info:
@@ -343,3 +928,72 @@ def test_get_analogies(mock_result):
 
     # Assert
     assert_frame_equal(partial_mock_top_analogues, partial_df_expected)
+
+
+def test_get_analogies_ties():
+    # Arrange
+    # with tectonic setting only, hundreds of volcanoes share the same
+    # (maximum) total analogy as the target volcano
+    weights = {'tectonic_setting': 1, 'geochemistry': 0, 'morphology': 0,
+               'eruption_size': 0, 'eruption_style': 0}
+    volcans_result = calculate_weighted_analogy_matrix('Hekla', weights)
+
+    # Act
+    top_analogues, _ = get_analogies('Hekla', volcans_result, 20)
+
+    # Assert
+    # ties are ordered by index, and the target volcano is always excluded
+    assert len(top_analogues) == 20
+    assert (top_analogues['total_analogy'] == 1).all()
+    assert convert_to_idx('Hekla') not in top_analogues.index
+    assert top_analogues.index.is_monotonic_increasing
+
+
+def test_top_analogues_query_does_not_import_optional_modules():
+    # Arrange
+    code = ("import sys\n"
+            "from pyvolcans.pyvolcans_func import (WEIGHTS, get_analogies,\n"
+            "    calculate_weighted_analogy_matrix)\n"
+            "result = calculate_weighted_analogy_matrix('Hekla', WEIGHTS)\n"
+            "get_analogies('Hekla', result)\n"
+            "print([module for module in ('matplotlib', 'thefuzz',\n"
+            "       'webbrowser') if module in sys.modules])\n")
+
+    # Act
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+
+    # Assert
+    assert output.strip() == '[]'
+
+
+def _total_analogy_from_store(volcano, store):
+    """Run in worker processes by test_shared_analogy_store."""
+    result = calculate_weighted_analogy_matrix(volcano, WEIGHTS, store)
+    return result['total_analogy'].to_numpy(), \
+        get_volcano_source_data(volcano, store)['morphology']
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8),
+                    reason="multiprocessing.shared_memory requires Python 3.8")
+def test_shared_analogy_store():
+    # Arrange
+    volcanoes = ['Hekla', 'Fuego', 'Vesuvius']
+    expected = [calculate_weighted_analogy_matrix(volcano, WEIGHTS)
+                for volcano in volcanoes]
+
+    # Act
+    with SharedAnalogyStore.publish() as store:
+        assert pickle.loads(pickle.dumps(store)) is store
+        assert not store.data['morphology'].flags.writeable
+        with multiprocessing.Pool(2) as pool:
+            results = pool.starmap(_total_analogy_from_store,
+                                   [(volcano, store) for volcano in volcanoes])
+
+    # Assert
+    for (total_analogy, morphology), volcano, expected_result in zip(
+            results, volcanoes, expected):
+        np.testing.assert_array_equal(total_analogy,
+                                      expected_result['total_analogy'])
+        assert morphology == get_volcano_source_data(volcano)['morphology']
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the timing of the PyVOLCANS processing stages.
+"""
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+
+from pyvolcans.timings import TIMER, StageTimer, timed
+
+
+def test_stage_timer():
+    # Arrange
+    timer = StageTimer()
+    timer.start_memory_tracing()
+
+    # Act
+    with timer.stage('outer'):
+        for _ in range(2):
+            with timer.stage('inner'):
+                np.ones(1_000_000)
+    timer.record('package import', 0.5, first=True)
+    report = timer.report()
+    tracemalloc.stop()
+
+    # Assert
+    assert list(timer.stages) == ['package import', 'outer', 'inner']
+    assert timer.stages['inner']['calls'] == 2
+    assert timer.stages['outer']['seconds'] >= timer.stages['inner']['seconds']
+    # each array of ones takes 8 MB
+    assert timer.stages['inner']['peak_bytes'] >= 8e6
+    assert timer.stages['outer']['peak_bytes'] >= 8e6
+    assert 'package import' in report
+
+
+def test_timed(monkeypatch):
+    # Arrange
+    @timed
+    def add_one(value):
+        return value + 1
+
+    # Act
+    monkeypatch.setattr(TIMER, 'enabled', False)
+    disabled_result = add_one(1)
+    recorded_when_disabled = 'add_one' in TIMER.stages
+    monkeypatch.setattr(TIMER, 'enabled', True)
+    enabled_result = add_one(2)
+
+    # Assert
+    assert disabled_result == 2
+    assert enabled_result == 3
+    assert not recorded_when_disabled
+    assert TIMER.stages['add_one']['calls'] == 1
+
+
+def test_import_does_not_enable_timer():
+    # The timer is only enabled by the command line interface, whatever the
+    # arguments of the process that imports pyvolcans
+    code = ("import sys; sys.argv[1:] = ['--timings']; "
+            "import pyvolcans.pyvolcans; "
+            "from pyvolcans.timings import TIMER; print(TIMER.enabled)")
+
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == 'False'